@@ -0,0 +1,320 @@
+# Benchmarks for the agents. Times requests() and uploads() of every agent
+# class against synthetic peers, requests and history while sweeping swarm
+# size, numPieces, blocksPerPiece and history length, and times whole
+# synthetic swarm rounds. Results are written as JSON lines and can be
+# checked against a stored baseline.
+#
+# Run from the simulator directory (the agents need messages.py, util.py
+# and peer.py):
+#   python3 bench.py --quick
+#   python3 bench.py --saveBaseline=bench_baseline.json
+#   python3 bench.py --baseline=bench_baseline.json
+
+import sys
+import io
+import json
+import time
+import random
+import statistics
+import importlib
+import contextlib
+import collections
+from optparse import OptionParser
+
+from messages import Request
+from rarity import sharedIndex
+from snapshot import PeerSnapshot
+
+AGENTS = ["BitTorrent", "FairTorrent", "AngwyTorrent", "Freerider"]
+
+# the history events the agents read; Download and Upload in one record
+Event = collections.namedtuple("Event", "fromId toId piece blocks bw actual")
+
+class Config:
+    def __init__(self, numPieces, blocksPerPiece, maxBw):
+        self.numPieces = numPieces
+        self.blocksPerPiece = blocksPerPiece
+        self.maxUpBw = maxBw
+
+class PeerView:
+    """
+    What an agent sees of another peer: its id and complete pieces.
+    """
+    def __init__(self, id, availablePieces):
+        self.id = id
+        self.availablePieces = availablePieces
+
+class SyntheticHistory:
+    """
+    The per-agent history interface the agents use: downloads and uploads
+    per round, and currentRound().
+    """
+    def __init__(self):
+        self.downloads = []
+        self.uploads = []
+
+    def currentRound(self):
+        return len(self.downloads)
+
+def agentClass(name):
+    return getattr(importlib.import_module(name.lower()), name)
+
+def makeAgent(cls, id, conf, pieces, upBw):
+    """
+    Build an agent without going through the simulator's Peer constructor.
+    """
+    agent = cls.__new__(cls)
+    agent.id = id
+    agent.conf = conf
+    agent.pieces = pieces
+    agent.upBw = upBw
+    agent.maxRequests = min(conf.maxUpBw // conf.blocksPerPiece + 1, conf.numPieces)
+    # keep the agents' postInit() chatter out of the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent.postInit()
+    return agent
+
+def randomPieces(rng, numPieces, blocksPerPiece, fraction):
+    """
+    Block counts for an agent holding about `fraction` of the pieces.
+    """
+    return [blocksPerPiece if rng.random() < fraction else rng.randrange(blocksPerPiece)
+            for i in range(numPieces)]
+
+def syntheticRound(rng, selfId, peerIds, events, blocksPerPiece, numPieces):
+    """
+    One round of made-up Download and Upload events for selfId.
+    """
+    downloads = []
+    uploads = []
+    for i in range(events):
+        other = rng.choice(peerIds)
+        blocks = rng.randint(1, blocksPerPiece)
+        downloads.append(Event(other, selfId, rng.randrange(numPieces), blocks, blocks, blocks))
+        other = rng.choice(peerIds)
+        blocks = rng.randint(1, blocksPerPiece)
+        uploads.append(Event(selfId, other, rng.randrange(numPieces), blocks, blocks, blocks))
+    return (downloads, uploads)
+
+def timeCalls(fn, repeat):
+    """
+    returns: median seconds over repeat calls of fn(i)
+    """
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def microBench(name, peers, numPieces, blocksPerPiece, historyRounds, repeat, seed=0):
+    """
+    Time one agent's requests() and uploads() at round historyRounds. Each
+    timed call sees one more round of history than the last, which is what
+    an agent sees from one round to the next.
+
+    returns: {"requests": seconds, "uploads": seconds}
+    """
+    rng = random.Random(seed)
+    random.seed(seed)
+    sharedIndex.reset()
+    conf = Config(numPieces, blocksPerPiece, 32)
+    agent = makeAgent(agentClass(name), name + "0", conf,
+                      randomPieces(rng, numPieces, blocksPerPiece, 0.5), 24)
+    peerIds = ["Peer%d" % i for i in range(peers)]
+    views = PeerSnapshot(PeerView(p, [i for i in range(numPieces) if rng.random() < 0.5])
+                         for p in peerIds).without(agent.id)
+    requests = [Request(p, agent.id, rng.randrange(numPieces), rng.randrange(blocksPerPiece))
+                for p in peerIds for r in range(agent.maxRequests)]
+    history = SyntheticHistory()
+    eventsPerRound = min(peers, 8)
+
+    def grow():
+        (downloads, uploads) = syntheticRound(rng, agent.id, peerIds, eventsPerRound,
+                                              blocksPerPiece, numPieces)
+        history.downloads.append(downloads)
+        history.uploads.append(uploads)
+
+    for r in range(historyRounds):
+        grow()
+    # catch up incremental state on the history so far
+    agent.requests(views, history)
+    agent.uploads(requests, views, history)
+
+    def requestsCall(i):
+        agent.requests(views, history)
+
+    def uploadsCall(i):
+        grow()
+        agent.uploads(requests, views, history)
+
+    return {"requests": timeCalls(requestsCall, repeat),
+            "uploads": timeCalls(uploadsCall, repeat)}
+
+def swarmBench(name, peers, numPieces, blocksPerPiece, rounds, seed=0):
+    """
+    Run `rounds` synthetic swarm rounds of `peers` agents of one class, a
+    tenth of them starting with every piece, and time them.
+
+    returns: seconds per round
+    """
+    rng = random.Random(seed)
+    random.seed(seed)
+    sharedIndex.reset()
+    conf = Config(numPieces, blocksPerPiece, 32)
+    cls = agentClass(name)
+    agents = []
+    for i in range(peers):
+        pieces = [blocksPerPiece if i % 10 == 0 else 0] * numPieces
+        agents.append(makeAgent(cls, "%s%d" % (name, i), conf, pieces, rng.randint(16, 32)))
+    byId = dict((a.id, a) for a in agents)
+    histories = dict((a.id, SyntheticHistory()) for a in agents)
+
+    start = time.perf_counter()
+    snapshot = None
+    for r in range(rounds):
+        # one shared view of the swarm per round, as eventsim.py hands out
+        snapshot = PeerSnapshot((PeerView(a.id, [i for (i, b) in enumerate(a.pieces) if b == blocksPerPiece])
+                                 for a in agents), snapshot)
+        incoming = dict((a.id, []) for a in agents)
+        for a in agents:
+            for request in a.requests(snapshot.without(a.id), histories[a.id]):
+                incoming[request.peerId].append(request)
+        downloads = dict((a.id, []) for a in agents)
+        uploads = dict((a.id, []) for a in agents)
+        for a in agents:
+            for upload in a.uploads(incoming[a.id], snapshot.without(a.id), histories[a.id]):
+                # serve the requester's requests to a in order
+                receiver = byId[upload.toId]
+                left = upload.bw
+                for request in incoming[a.id]:
+                    if request.requesterId != upload.toId or left == 0:
+                        continue
+                    b = min(left, blocksPerPiece - receiver.pieces[request.pieceId])
+                    if b > 0:
+                        receiver.pieces[request.pieceId] += b
+                        left -= b
+                        downloads[receiver.id].append(Event(a.id, receiver.id, request.pieceId, b, b, b))
+                sent = upload.bw - left
+                uploads[a.id].append(Event(a.id, upload.toId, None, sent, upload.bw, sent))
+        for a in agents:
+            histories[a.id].downloads.append(downloads[a.id])
+            histories[a.id].uploads.append(uploads[a.id])
+    return (time.perf_counter() - start) / rounds
+
+def sweep(quick):
+    if quick:
+        return {"peers": [10, 50], "numPieces": [128], "blocksPerPiece": [16],
+                "history": [10, 100], "swarmPeers": [10], "rounds": 5, "repeat": 5}
+    return {"peers": [10, 50, 200], "numPieces": [128, 1024], "blocksPerPiece": [16, 64],
+            "history": [10, 100, 1000], "swarmPeers": [10, 30], "rounds": 10, "repeat": 11}
+
+def runAll(agents, quick):
+    """
+    returns: list of result records
+    """
+    s = sweep(quick)
+    results = []
+    for name in agents:
+        for peers in s["peers"]:
+            for numPieces in s["numPieces"]:
+                for blocksPerPiece in s["blocksPerPiece"]:
+                    for history in s["history"]:
+                        params = {"agent": name, "peers": peers, "numPieces": numPieces,
+                                  "blocksPerPiece": blocksPerPiece, "history": history}
+                        try:
+                            times = microBench(name, peers, numPieces, blocksPerPiece,
+                                               history, s["repeat"])
+                        except Exception as e:
+                            times = dict((b, None) for b in ("requests", "uploads"))
+                            params["error"] = repr(e)
+                        for (bench, seconds) in sorted(times.items()):
+                            results.append(dict(params, bench=bench, seconds=seconds))
+        for peers in s["swarmPeers"]:
+            for numPieces in s["numPieces"]:
+                params = {"agent": name, "peers": peers, "numPieces": numPieces,
+                          "blocksPerPiece": s["blocksPerPiece"][0], "history": s["rounds"],
+                          "bench": "swarmRound"}
+                try:
+                    seconds = swarmBench(name, peers, numPieces, params["blocksPerPiece"], s["rounds"])
+                except Exception as e:
+                    seconds = None
+                    params["error"] = repr(e)
+                results.append(dict(params, seconds=seconds))
+    return results
+
+def resultKey(record):
+    return (record["bench"], record["agent"], record["peers"], record["numPieces"],
+            record["blocksPerPiece"], record["history"])
+
+def compare(results, baseline, tolerance):
+    """
+    returns: list of (record, baseline seconds) for every result more than
+    `tolerance` (a fraction) slower than its baseline, or that failed where
+    the baseline has a time
+    """
+    old = dict((resultKey(r), r["seconds"]) for r in baseline)
+    regressions = []
+    for r in results:
+        before = old.get(resultKey(r))
+        if before is None:
+            continue
+        if r["seconds"] is None or r["seconds"] > before * (1 + tolerance):
+            regressions.append((r, before))
+    return regressions
+
+def readResults(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def writeResults(path, results):
+    with open(path, "w") as f:
+        for r in results:
+            f.write(json.dumps(r, sort_keys=True) + "\n")
+
+def main(args):
+    parser = OptionParser(usage="Usage:  %prog [options] [AgentClass ...]")
+    parser.add_option("--quick", dest="quick", default=False, action="store_true",
+                      help="small sweep for a fast check")
+    parser.add_option("--out", dest="out", default="bench_output.txt",
+                      help="where to write the results, one JSON record per line")
+    parser.add_option("--baseline", dest="baseline", default=None,
+                      help="flag results slower than this stored run")
+    parser.add_option("--tolerance", dest="tolerance", default=0.25, type="float",
+                      help="allowed slowdown against the baseline, as a fraction")
+    parser.add_option("--saveBaseline", dest="saveBaseline", default=None,
+                      help="also store the results as a baseline here")
+    (options, agents) = parser.parse_args(args)
+    if len(agents) == 0:
+        agents = AGENTS
+
+    results = runAll(agents, options.quick)
+    writeResults(options.out, results)
+    if options.saveBaseline is not None:
+        writeResults(options.saveBaseline, results)
+
+    for r in results:
+        if r["seconds"] is None:
+            print("%-10s %-12s peers=%-4d pieces=%-5d bpp=%-3d history=%-5d  error: %s" % (
+                r["bench"], r["agent"], r["peers"], r["numPieces"], r["blocksPerPiece"],
+                r["history"], r["error"]))
+        else:
+            print("%-10s %-12s peers=%-4d pieces=%-5d bpp=%-3d history=%-5d %10.1f us" % (
+                r["bench"], r["agent"], r["peers"], r["numPieces"], r["blocksPerPiece"],
+                r["history"], r["seconds"] * 1e6))
+
+    if options.baseline is not None:
+        regressions = compare(results, readResults(options.baseline), options.tolerance)
+        for (r, before) in regressions:
+            if r["seconds"] is None:
+                after = "error: %s" % r["error"]
+            else:
+                after = "%.1f us" % (r["seconds"] * 1e6)
+            print("REGRESSION %s %s peers=%d pieces=%d bpp=%d history=%d: %.1f us -> %s" % (
+                r["bench"], r["agent"], r["peers"], r["numPieces"], r["blocksPerPiece"],
+                r["history"], before * 1e6, after))
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
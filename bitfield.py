@@ -0,0 +1,42 @@
+# Packed piece bitfields: bit i of a Python int is set when piece i is held.
+# Intersections and unions of whole piece sets become single int operations.
+
+# the piece offsets set in each possible byte value
+_BYTE_PIECES = [tuple(b for b in range(8) if byte >> b & 1) for byte in range(256)]
+
+def toBits(pieceIds):
+    """
+    Pack an iterable of piece ids into a bitfield.
+    """
+    buf = bytearray()
+    for pieceId in pieceIds:
+        byteIndex = pieceId >> 3
+        if byteIndex >= len(buf):
+            buf.extend(bytes(byteIndex + 1 - len(buf)))
+        buf[byteIndex] |= 1 << (pieceId & 7)
+    return int.from_bytes(bytes(buf), "little")
+
+def fullBits(numPieces):
+    """
+    The bitfield holding every piece of an numPieces-piece torrent.
+    """
+    return (1 << numPieces) - 1
+
+def pieceIds(bits):
+    """
+    Unpack a bitfield into an ascending list of piece ids.
+    """
+    ids = []
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+    for byteIndex, byte in enumerate(data):
+        if byte:
+            base = byteIndex << 3
+            for offset in _BYTE_PIECES[byte]:
+                ids.append(base + offset)
+    return ids
+
+def count(bits):
+    """
+    Number of pieces in a bitfield.
+    """
+    return bin(bits).count("1")
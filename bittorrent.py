@@ -7,15 +7,27 @@ from distutils.command.upload import upload
 import random
 import re
 import logging
-import collections
 
-from messages import Upload, Request
+from messages import Upload
 from util import evenSplit
 from peer import Peer
+from instrument import instrumented
+from rarity import sharedIndex
+from bitfield import toBits, fullBits, pieceIds
+from planner import planRequests
+from reciprocation import ReciprocationTracker
 
+@instrumented
 class BitTorrent(Peer):
+    # rounds of downloads the regular unchoke slots are ranked over
+    reciprocationWindow = 5
+    # rounds between picks of the optimistic unchoke
+    optimisticPeriod = 3
+
     def postInit(self):  
         print("postInit(): %s here!" % self.id)
+        self.tracker = ReciprocationTracker(self.reciprocationWindow)
+        self.additional = None  # the optimistic unchoke, picked every optimisticPeriod rounds
     
     def requests(self, peers, history):
         """
@@ -28,11 +40,13 @@ class BitTorrent(Peer):
         """
         needed = lambda i: self.pieces[i] < self.conf.blocksPerPiece
         neededPieces = filter(needed, range(len(self.pieces)))
-        npSet = set(neededPieces)  # sets support fast intersection ops
+        npBits = toBits(neededPieces)  # bitfields support fast intersection ops
 
 
-        logging.debug("%s here: still need pieces %s" % (
-            self.id, list(neededPieces)))
+        # only build the piece lists when someone will read them
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        if debug:
+            logging.debug("%s here: still need pieces %s", self.id, pieceIds(npBits))
 
         #logging.debug("%s still here. Here are some peers:" % self.id)
         #for p in peers:
@@ -45,46 +59,13 @@ class BitTorrent(Peer):
         # Symmetry breaking 
         random.shuffle(list(neededPieces))
         
-        pieces = []
-        #collect data on all avaliable pieces
-        for p in peers:
-            if len(p.availablePieces) != 0:
-                pieces = pieces + list(p.availablePieces)
-        frequencyDict = collections.Counter(pieces) #create dictionary of frequencies
-        frequency = list(frequencyDict.items())
-        random.shuffle(frequency) #shuffle frequencies in list form
-
-        #add additional random int to each list of the id and frequency as a tie breaker
-        frequencyLists = []
-        for x in range(0, len(frequency)):
-            frequencyLists.append(list(frequency[x]) + [x])
-
-        #sort the list of ids by the frequency and then randomly via the x[2]
-        frequencyLists.sort(key=lambda x: (x[1], x[2]), reverse=False)
-        desireList = []
-        for x in range(0, len(frequencyLists)):
-            desireList.append(frequencyLists[x][0])
-
-        # can request up to self.maxRequests from each
-        for peer in peers:
-            avSet = set(peer.availablePieces)
-            isect = avSet.intersection(npSet)
-            # More symmetry breaking -- ask for random pieces.
-            # This would be the place to try fancier piece-requesting strategies
-            # to avoid getting the same thing from multiple peers at a time.
-            onePeer = []
-            n = min(self.maxRequests, len(isect))  
-            # start from the most desired piece and go down the list till you fill the max number of requests
-            for pieceId in desireList:
-                if pieceId in isect:
-                # aha! The peer has this piece! Request it.
-                # which part of the piece do we need next?
-                # (must get the next-needed blocks in order)
-                    if len(onePeer) < n:
-                        startBlock = self.pieces[pieceId]
-                        r = Request(self.id, peer.id, pieceId, startBlock)
-                        onePeer.append(r)
-            requests = requests + onePeer
+        # rarest-first order of the pieces we still need, kept once for the whole swarm
+        sharedIndex.update(peers)
+        sharedIndex.observeBits(self.id, fullBits(len(self.pieces)) & ~npBits)
+        desireList = sharedIndex.desireOrder(npBits)
+
+        # spread the pieces over the peers that have them; endgame at the end
+        requests = planRequests(self, peers, sharedIndex, npBits, desireList)
         return requests
 
     def uploads(self, requests, peers, history):
@@ -99,19 +80,17 @@ class BitTorrent(Peer):
         """
 
         round = history.currentRound()
-        logging.debug("%s again.  It's round %d." % (
-            self.id, round))
+        logging.debug("%s again.  It's round %d.", self.id, round)
         # One could look at other stuff in the history too here.
         # For example, history.downloads[round-1] (if round != 0, of course)
         # has a list of Download objects for each Download to this peer in
         # the previous round.
 
         # update the optimistic upload
-        if len(history.uploads) % 3 == 0:
-            randomInt = random.randint(0, len(peers)-1)
-            while re.match("Seed", peers[randomInt].id):
-                randomInt = random.randint(0, len(peers)-1)
-            self.additional = peers[randomInt].id
+        if len(history.uploads) % self.optimisticPeriod == 0:
+            # any peer but a seed; there may be none left
+            candidates = [p.id for p in peers if not re.search("Seed", p.id)]
+            self.additional = random.choice(candidates) if candidates else None
 
         # in the case that there are no requests, do not upload anything
         if len(requests) == 0:
@@ -120,7 +99,6 @@ class BitTorrent(Peer):
             bws = []
         else:
 
-            pastmoves = []
             uploadList = []
 
             requestIDs = set()
@@ -134,14 +112,12 @@ class BitTorrent(Peer):
             for x in peers:
                 peerIDs.add(x.id)
 
-            # maintain the optimistic slot and update it every three rounds
+            # maintain the optimistic slot and update it every optimisticPeriod rounds
             # if the optimistic slot is not requesting anything from the given peer, dont upload to it
 
             # collect data regarding past moves of peers
-            aRound = history.downloads[-1]
-            for move in aRound:
-                pastmoves = pastmoves + [move.fromId] * move.blocks
-            moveDict = collections.Counter(pastmoves) #create dictionary of frequencies
+            self.tracker.update(history)
+            moveDict = self.tracker.received() #blocks from each peer over the window
             frequency = list(moveDict.items())
 
             chokeList = []
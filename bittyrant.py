@@ -0,0 +1,176 @@
+# A strategic uploader after BitTyrant (Piatek et al., "Do incentives build
+# robustness in BitTorrent?", papers/BitTyrantPiatek07.pdf).
+#
+# For every peer j it keeps d_j, the blocks per round j gives us while we
+# unchoke it, and u_j, the blocks per round we must give j for it to
+# reciprocate. Each round it unchokes the requesters with the best d_j/u_j
+# until u_j adds up to its upload bandwidth, and gives each its u_j:
+#  - j reciprocated: d_j is what j sent; after `reciprocationRounds` rounds
+#    in a row, u_j shrinks by a factor (1 - gamma)
+#  - j was unchoked but did not reciprocate: u_j grows by (1 + delta)
+#  - never reciprocated: both are estimated from how fast j announces new
+#    pieces, as j's upload split over BitTorrent's `slots` unchoke slots,
+#    but at least half a slot's share of the fastest upload (maxUpBw)
+# Requests are the rarest-first planner of the other agents.
+
+import random
+import logging
+
+from messages import Upload
+from util import evenSplit
+from peer import Peer
+from instrument import instrumented
+from rarity import sharedIndex
+from bitfield import toBits, fullBits, pieceIds
+from planner import planRequests
+
+class TyrantEstimates:
+    """
+    d_j and u_j per peer, updated only from the rounds of history and the
+    piece announcements not seen yet.
+    """
+    def __init__(self, blocksPerPiece, slots, floor, gamma, delta, reciprocationRounds):
+        self.blocksPerPiece = blocksPerPiece
+        self.slots = slots
+        self.floor = floor
+        self.gamma = gamma
+        self.delta = delta
+        self.reciprocationRounds = reciprocationRounds
+        self.reset()
+
+    def reset(self):
+        self.d = dict()        # peerId -> blocks per round received while unchoked
+        self.u = dict()        # peerId -> blocks per round needed for reciprocation
+        self.streak = dict()   # peerId -> rounds in a row it has sent us blocks
+        self.announced = dict()  # peerId -> pieces it had when last looked at
+        self.rate = dict()     # peerId -> blocks per round it downloads, smoothed
+        self.roundsSeen = 0
+        self.lastLook = 0
+
+    def update(self, peers, history):
+        if len(history.downloads) < self.roundsSeen:
+            # history went backwards: a new run started
+            self.reset()
+        for r in range(self.roundsSeen, len(history.downloads)):
+            self.addRound(history.downloads[r], history.uploads[r])
+        self.roundsSeen = len(history.downloads)
+
+        elapsed = history.currentRound() - self.lastLook
+        if elapsed > 0:
+            for p in peers:
+                have = len(p.availablePieces)
+                gained = have - self.announced.get(p.id, have)
+                self.announced[p.id] = have
+                blocks = gained * self.blocksPerPiece / elapsed
+                # smooth the piece-sized jumps in what a peer announces
+                self.rate[p.id] = 0.5 * self.rate.get(p.id, blocks) + 0.5 * blocks
+            self.lastLook = history.currentRound()
+
+    def addRound(self, downloads, uploads):
+        received = dict()
+        for d in downloads:
+            received[d.fromId] = received.get(d.fromId, 0) + d.blocks
+        for (peerId, blocks) in received.items():
+            self.d[peerId] = blocks
+            self.streak[peerId] = self.streak.get(peerId, 0) + 1
+            if self.streak[peerId] >= self.reciprocationRounds and peerId in self.u:
+                self.u[peerId] *= 1 - self.gamma
+        for peerId in list(self.streak):
+            if peerId not in received:
+                del self.streak[peerId]
+        for u in uploads:
+            if u.toId not in received:
+                self.u[u.toId] = self.need(u.toId) * (1 + self.delta)
+
+    def estimate(self, peerId):
+        """
+        Blocks per round peerId is expected to give each of its unchoked
+        peers, from how fast it gains pieces.
+        """
+        return max(self.floor, self.rate.get(peerId, 0.0) / self.slots)
+
+    def gain(self, peerId):
+        return self.d.get(peerId) or self.estimate(peerId)
+
+    def need(self, peerId):
+        return self.u.get(peerId) or self.estimate(peerId)
+
+@instrumented
+class BitTyrant(Peer):
+    # BitTorrent's unchoke slots, used to guess what a peer gives each one
+    slots = 4
+    # shrink u_j by gamma after reciprocationRounds rounds of reciprocation,
+    # grow it by delta when j does not reciprocate (the paper's values)
+    gamma = 0.1
+    delta = 0.2
+    reciprocationRounds = 3
+
+    def postInit(self):
+        print("postInit(): %s here!" % self.id)
+        floor = max(1.0, self.conf.maxUpBw / (2.0 * self.slots))
+        self.estimates = TyrantEstimates(self.conf.blocksPerPiece, self.slots, floor,
+                                         self.gamma, self.delta, self.reciprocationRounds)
+
+    def requests(self, peers, history):
+        """
+        peers: available info about the peers (who has what pieces)
+        history: what's happened so far as far as this peer can see
+
+        returns: a list of Request() objects
+
+        This will be called after updatePieces() with the most recent state.
+        """
+        needed = lambda i: self.pieces[i] < self.conf.blocksPerPiece
+        npBits = toBits(filter(needed, range(len(self.pieces))))
+
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("%s here: still need pieces %s", self.id, pieceIds(npBits))
+
+        # rarest-first order of the pieces we still need, kept once for the whole swarm
+        sharedIndex.update(peers)
+        sharedIndex.observeBits(self.id, fullBits(len(self.pieces)) & ~npBits)
+        desireList = sharedIndex.desireOrder(npBits)
+
+        # spread the pieces over the peers that have them; endgame at the end
+        return planRequests(self, peers, sharedIndex, npBits, desireList)
+
+    def uploads(self, requests, peers, history):
+        """
+        requests -- a list of the requests for this peer for this round
+        peers -- available info about all the peers
+        history -- history for all previous rounds
+
+        returns: list of Upload objects.
+
+        In each round, this will be called after requests().
+        """
+        round = history.currentRound()
+        logging.debug("%s again.  It's round %d.", self.id, round)
+        self.estimates.update(peers, history)
+        if len(requests) == 0:
+            return []
+
+        requesters = sorted(set(r.requesterId for r in requests))
+        # random tie-breaks, then best return per uploaded block first
+        random.shuffle(requesters)
+        e = self.estimates
+        requesters.sort(key=lambda j: e.gain(j) / e.need(j), reverse=True)
+
+        # the active set: the best ratios whose u_j fit in our bandwidth
+        active = []
+        used = 0
+        for j in requesters:
+            bw = max(1, int(e.need(j) + 0.5))
+            if used + bw > self.upBw:
+                break
+            active.append((j, bw))
+            used += bw
+        if not active:
+            # even the best peer wants more than we have: give it everything
+            active = [(requesters[0], self.upBw)]
+            used = self.upBw
+
+        # whatever is left over is split evenly over the active set
+        extra = evenSplit(self.upBw - used, len(active))
+        logging.debug("Still here: uploading %s", active)
+        return [Upload(self.id, j, bw + more) for ((j, bw), more) in zip(active, extra)]
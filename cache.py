@@ -0,0 +1,145 @@
+# On-disk cache of per-iteration simulation results, addressed by a hash of
+# the run configuration and of the source code that produced it.
+
+import os
+import ast
+import json
+import hashlib
+
+def localImports(path):
+    """
+    Names of the modules imported by the Python file at path.
+    """
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                names.add(alias.name.split(".")[0])
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            names.add(node.module.split(".")[0])
+    return names
+
+def sourceHash(moduleNames, directory):
+    """
+    Hash of the source of the given modules and of every module in directory
+    they import, directly or not. Editing one agent only changes the hash of
+    the configurations that load it.
+    """
+    seen = set()
+    todo = list(moduleNames)
+    while todo:
+        name = todo.pop()
+        path = os.path.join(directory, name + ".py")
+        if name in seen or not os.path.exists(path):
+            continue
+        seen.add(name)
+        todo.extend(localImports(path))
+
+    h = hashlib.sha256()
+    for name in sorted(seen):
+        with open(os.path.join(directory, name + ".py"), "rb") as f:
+            source = f.read()
+        h.update(name.encode() + b"\0")
+        h.update(hashlib.sha256(source).digest())
+    return h.hexdigest()
+
+class ResultCache:
+    """
+    One JSON file per cached iteration under directory. Hits refresh a
+    file's modification time, and once the directory grows past maxBytes
+    the least recently used files are removed, down to `lowWater` of
+    maxBytes so that the next scan is many puts away.
+    """
+    lowWater = 0.9
+
+    def __init__(self, directory, maxBytes=None):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        # bytes in the directory, tracked across puts once first scanned
+        self.bytes = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, config):
+        """
+        config: JSON-serialisable description of one iteration, including
+        the source hash of the code it runs
+        """
+        data = json.dumps(config, sort_keys=True).encode()
+        return hashlib.sha256(data).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        """
+        returns: the cached result for key, or None
+        """
+        path = self.path(key)
+        try:
+            with open(path) as f:
+                result = json.load(f)
+        except (IOError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(path, None)
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        path = self.path(key)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(result, f)
+        if self.maxBytes is not None:
+            if self.bytes is None:
+                self.bytes = sum(size for (mtime, size, p) in self.entries())
+            if os.path.exists(path):
+                # an entry being replaced
+                self.bytes -= os.stat(path).st_size
+            self.bytes += os.stat(tmp).st_size
+        # rename so a crash never leaves a half written entry behind
+        os.replace(tmp, path)
+        if self.maxBytes is not None and self.bytes > self.maxBytes:
+            self.evict(int(self.maxBytes * self.lowWater))
+
+    def entries(self):
+        """
+        returns: list of (modification time, size, path), oldest first
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                path = os.path.join(self.directory, name)
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        return entries
+
+    def evict(self, maxBytes):
+        """
+        Remove least recently used entries until the cache fits in maxBytes.
+        """
+        entries = self.entries()
+        total = sum(size for (mtime, size, path) in entries)
+        for (mtime, size, path) in entries:
+            if total <= maxBytes:
+                break
+            os.remove(path)
+            total -= size
+            self.evictions += 1
+        self.bytes = total
+
+    def stats(self):
+        entries = self.entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(entries),
+            "bytes": sum(size for (mtime, size, path) in entries),
+        }
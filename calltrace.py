@@ -0,0 +1,334 @@
+# Recording and replay of what the agents see, for evaluating one agent
+# without rerunning the swarm.
+#
+# eventsim.py --trace=FILE writes, for every requests() and uploads() call,
+# the new pieces announced since the last call (HAVEs), the neighbor sets
+# as they change (with --neighbors), the caller's own block counts that
+# changed, the rounds of history it had not been handed yet, the requests
+# sent to it (uploads() only) and what it returned.
+# Before each call the random module is seeded from the trace's own
+# generator and the seed is recorded, so a replay of the same agent
+# repeats its decisions exactly. (A traced run therefore draws different
+# random numbers than an untraced one with the same --seed.)
+#
+# Replay feeds the recorded calls, in order, to fresh agents of the
+# recorded classes or of another class and diffs what they return against
+# the trace; no pieces move, so thousands of rounds take seconds:
+#   python3 calltrace.py run.trace
+#   python3 calltrace.py --agent=PropShare --peers=BitTorrent run.trace
+#
+# Layout (gzip, little-endian): MAGIC, the Config, the peer table (id,
+# class, upBw, block counts, complete pieces), then records, each a tag
+# byte followed by int32 arrays of (length, values):
+#   H  (peer, piece) pairs
+#   N  peer, then its neighbors
+#   R, U  round, peer, seed; changed pieces and their blocks; rounds of
+#      history, each (from, piece, blocks) downloads and (to, bw, actual)
+#      uploads; U only: (requester, piece, start) requests; then the
+#      result, (peer, piece, start) requests or (to, bw) uploads
+
+import io
+import sys
+import gzip
+import time
+import array
+import random
+import struct
+import importlib
+import contextlib
+from optparse import OptionParser
+
+from messages import Upload, Download, Request, PeerInfo
+from metrics import agentType
+from rarity import sharedIndex
+from snapshot import PeerSnapshot
+from eventsim import Config, PeerHistory
+
+MAGIC = b"SIMTRAC2"
+
+def packInts(values):
+    a = array.array("i", values)
+    if sys.byteorder != "little":
+        a.byteswap()
+    return struct.pack("<I", len(a)) + a.tobytes()
+
+def packString(s):
+    data = s.encode("utf-8")
+    return struct.pack("<H", len(data)) + data
+
+class TraceWriter:
+    """
+    Records the calls an EventSim makes to its agents. begin() before each
+    call, end() after it.
+    """
+    def __init__(self, path, sim, seed=None):
+        self.out = gzip.open(path, "wb", compresslevel=4)
+        self.rng = random.Random(seed)
+        self.index = dict((p.id, i) for (i, p) in enumerate(sim.peers))
+        # what each peer was last handed: its block counts and history length
+        self.pieces = dict((p.id, list(p.pieces)) for p in sim.peers)
+        self.seenRounds = dict((p.id, 0) for p in sim.peers)
+        self.announced = dict((p.id, len(sim.info[p.id].availablePieces)) for p in sim.peers)
+        self.seed = None
+
+        conf = sim.conf
+        header = [MAGIC, struct.pack("<5I", conf.numPieces, conf.blocksPerPiece, conf.minUpBw,
+                                     conf.maxUpBw, conf.maxRound),
+                  struct.pack("<I", len(sim.peers))]
+        for p in sim.peers:
+            header.append(packString(p.id))
+            header.append(packString(type(p).__name__))
+            header.append(struct.pack("<I", p.upBw))
+            header.append(packInts(p.pieces))
+            header.append(packInts(sim.info[p.id].availablePieces))
+        self.out.write(b"".join(header))
+        if sim.tracker is not None:
+            self.neighbors(sim.tracker, [p.id for p in sim.peers])
+
+    def neighbors(self, tracker, peerIds):
+        """
+        Record the current neighbors of the given peers.
+        """
+        index = self.index
+        for peerId in sorted(peerIds, key=index.get):
+            self.out.write(b"N" + packInts([index[peerId]] + [index[q] for q in tracker.of(peerId)]))
+
+    def have(self, info):
+        """
+        info: {peerId: PeerInfo}; records the pieces added to each
+        availablePieces since the last look
+        """
+        pairs = []
+        for (peerId, i) in self.index.items():
+            pieces = info[peerId].availablePieces
+            for pieceId in pieces[self.announced[peerId]:]:
+                pairs.extend((i, pieceId))
+            self.announced[peerId] = len(pieces)
+        if pairs:
+            self.out.write(b"H" + packInts(pairs))
+
+    def begin(self):
+        """
+        Seed the random module for the next call.
+        """
+        self.seed = self.rng.getrandbits(31)
+        random.seed(self.seed)
+
+    def end(self, kind, round, agent, history, requests, result):
+        """
+        kind: "R" for requests(), "U" for uploads()
+        requests: the requests handed to uploads(), None for requests()
+        result: what the call returned
+        """
+        index = self.index
+        last = self.pieces[agent.id]
+        changed = [i for (i, b) in enumerate(agent.pieces) if b != last[i]]
+        for i in changed:
+            last[i] = agent.pieces[i]
+
+        parts = [kind.encode(), packInts([round, index[agent.id], self.seed]),
+                 packInts(changed), packInts([agent.pieces[i] for i in changed])]
+        start = self.seenRounds[agent.id]
+        parts.append(packInts([len(history.downloads) - start]))
+        for r in range(start, len(history.downloads)):
+            parts.append(packInts([x for d in history.downloads[r]
+                                   for x in (index[d.fromId], d.piece, d.blocks)]))
+            parts.append(packInts([x for u in history.uploads[r]
+                                   for x in (index[u.toId], u.bw, u.actual)]))
+        self.seenRounds[agent.id] = len(history.downloads)
+
+        if kind == "U":
+            parts.append(packInts([x for r in requests
+                                   for x in (index[r.requesterId], r.pieceId, r.start)]))
+            parts.append(packInts([x for u in result for x in (index[u.toId], u.bw)]))
+        else:
+            parts.append(packInts([x for r in result for x in (index[r.peerId], r.pieceId, r.start)]))
+        self.out.write(b"".join(parts))
+
+    def close(self):
+        self.out.close()
+
+class TraceReader:
+    """
+    Parses a trace: the Config and peer table, then the records from
+    records().
+    """
+    def __init__(self, path):
+        with gzip.open(path, "rb") as f:
+            self.data = f.read()
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s is not a trace" % path)
+        self.pos = len(MAGIC)
+        self.conf = Config(*self.unpack("<5I"))
+        self.ids = []
+        self.classNames = []
+        self.upBws = []
+        self.initPieces = []
+        self.available = []
+        for i in range(self.unpack("<I")[0]):
+            self.ids.append(self.string())
+            self.classNames.append(self.string())
+            self.upBws.append(self.unpack("<I")[0])
+            self.initPieces.append(self.ints().tolist())
+            self.available.append(self.ints().tolist())
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return values
+
+    def string(self):
+        (n,) = self.unpack("<H")
+        self.pos += n
+        return self.data[self.pos - n:self.pos].decode("utf-8")
+
+    def ints(self):
+        (n,) = self.unpack("<I")
+        a = array.array("i")
+        a.frombytes(self.data[self.pos:self.pos + 4 * n])
+        if sys.byteorder != "little":
+            a.byteswap()
+        self.pos += 4 * n
+        return a
+
+    def records(self):
+        """
+        Yields ("H", pairs), ("N", [peer] + neighbors) and (kind, round, peer, seed, changed, blocks,
+        rounds, requests, result) with rounds a list of (downloads, uploads)
+        and every entry still flat int arrays of peer indices and values.
+        """
+        while self.pos < len(self.data):
+            kind = chr(self.data[self.pos])
+            self.pos += 1
+            if kind in "HN":
+                yield (kind, self.ints())
+                continue
+            (round, peer, seed) = self.ints()
+            changed = self.ints()
+            blocks = self.ints()
+            rounds = [(self.ints(), self.ints()) for r in range(self.ints()[0])]
+            requests = self.ints() if kind == "U" else None
+            yield (kind, round, peer, seed, changed, blocks, rounds, requests, self.ints())
+
+def triples(a):
+    return [tuple(a[i:i + 3]) for i in range(0, len(a), 3)]
+
+def uploadEvent(fromId, toId, bw, actual):
+    """
+    An Upload as the simulator keeps it in history, with the blocks that
+    were actually sent.
+    """
+    u = Upload(fromId, toId, bw)
+    u.actual = actual
+    return u
+
+def pairs(a):
+    return [tuple(a[i:i + 2]) for i in range(0, len(a), 2)]
+
+def replay(path, agentName=None, types=None, show=5):
+    """
+    Feed the trace at path to fresh agents and compare their decisions with
+    the recorded ones.
+
+    agentName: agent class to use instead of the recorded ones
+    types: only replay the peers of these recorded agent types (all by default)
+    show: number of differing calls to print
+
+    returns: {"calls": {kind: n}, "diffs": {kind: n}, "seconds": {kind: s}}
+    """
+    reader = TraceReader(path)
+    conf = reader.conf
+    ids = reader.ids
+    position = dict((peerId, i) for (i, peerId) in enumerate(ids))
+    sharedIndex.reset()
+
+    agents = dict()
+    for (i, peerId) in enumerate(ids):
+        if types is not None and agentType(peerId) not in types:
+            continue
+        name = agentName or reader.classNames[i]
+        cls = getattr(importlib.import_module(name.lower()), name)
+        with contextlib.redirect_stdout(io.StringIO()):
+            agents[i] = cls(conf, peerId, reader.initPieces[i], reader.upBws[i])
+    histories = dict((i, PeerHistory()) for i in agents)
+    # neighbor ids of each peer, if the run had neighbor sets
+    neighbors = dict()
+    available = [list(a) for a in reader.available]
+    snapshot = PeerSnapshot(PeerInfo(peerId, available[i]) for (i, peerId) in enumerate(ids))
+
+    stats = {"calls": {"R": 0, "U": 0}, "diffs": {"R": 0, "U": 0},
+             "seconds": {"R": 0.0, "U": 0.0}}
+    for record in reader.records():
+        if record[0] == "H":
+            for (i, pieceId) in pairs(record[1]):
+                available[i].append(pieceId)
+            snapshot = PeerSnapshot((PeerInfo(peerId, available[i]) for (i, peerId) in enumerate(ids)),
+                                    snapshot)
+            continue
+        if record[0] == "N":
+            neighbors[record[1][0]] = [ids[q] for q in record[1][1:]]
+            continue
+        (kind, round, i, seed, changed, blocks, rounds, requests, result) = record
+        agent = agents.get(i)
+        if agent is None:
+            continue
+        for (pieceId, b) in zip(changed, blocks):
+            agent.pieces[pieceId] = b
+        history = histories[i]
+        for (downloads, uploads) in rounds:
+            history.downloads.append([Download(ids[f], ids[i], piece, b)
+                                      for (f, piece, b) in triples(downloads)])
+            history.uploads.append([uploadEvent(ids[i], ids[t], bw, actual)
+                                    for (t, bw, actual) in triples(uploads)])
+        if i in neighbors:
+            peers = snapshot.among(neighbors[i])
+        else:
+            peers = snapshot.without(ids[i])
+
+        random.seed(seed)
+        if kind == "R":
+            start = time.perf_counter()
+            got = agent.requests(peers, history)
+            stats["seconds"][kind] += time.perf_counter() - start
+            got = [(position[r.peerId], r.pieceId, r.start) for r in got]
+            expected = triples(result)
+        else:
+            incoming = [Request(ids[r], ids[i], piece, s) for (r, piece, s) in triples(requests)]
+            start = time.perf_counter()
+            got = agent.uploads(incoming, peers, history)
+            stats["seconds"][kind] += time.perf_counter() - start
+            got = [(position[u.toId], u.bw) for u in got]
+            expected = pairs(result)
+        stats["calls"][kind] += 1
+        if got != expected:
+            stats["diffs"][kind] += 1
+            if stats["diffs"]["R"] + stats["diffs"]["U"] <= show:
+                method = "requests" if kind == "R" else "uploads"
+                print("round %d %s.%s():" % (round, ids[i], method))
+                print("  recorded %s" % [(ids[x[0]],) + x[1:] for x in expected])
+                print("  replayed %s" % [(ids[x[0]],) + x[1:] for x in got])
+    return stats
+
+def main(args):
+    usage_msg = "Usage:  %prog [options] TRACE"
+    parser = OptionParser(usage=usage_msg)
+    parser.add_option("--agent", dest="agent", default=None,
+                      help="replay with this agent class instead of the recorded ones")
+    parser.add_option("--peers", dest="peers", default=None,
+                      help="comma separated agent types to replay (default: all)")
+    parser.add_option("--show", dest="show", default=5, type="int",
+                      help="number of differing calls to print")
+    (options, paths) = parser.parse_args(args)
+    if len(paths) != 1:
+        parser.error("need one trace file")
+
+    types = set(options.peers.split(",")) if options.peers else None
+    stats = replay(paths[0], options.agent, types, options.show)
+    for (kind, method) in (("R", "requests"), ("U", "uploads")):
+        calls = stats["calls"][kind]
+        seconds = stats["seconds"][kind]
+        print("%s(): %d calls, %d differ, %.3f s (%.1f us/call)" % (
+            method, calls, stats["diffs"][kind], seconds, 1e6 * seconds / max(calls, 1)))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,73 @@
+# Checkpoints of a simulation's full state, for resuming a run that died
+# and for forking variant runs from a shared warm-up.
+#
+# The state is pickled (protocol 5) with every large contiguous buffer,
+# such as popsim.py's NumPy arrays, kept out of band. The file holds a
+# header, the pickle and then the buffers, each starting on a page
+# boundary. load() memory-maps the file and hands the buffers to the
+# unpickler in place, so arrays come back as views of the mapping: with
+# writable=True the mapping is copy-on-write, and forks of one checkpoint
+# share every page they never modify.
+#
+# Layout (little-endian):
+#   MAGIC, pickle offset and length, buffer count,
+#   (offset, length) per buffer, pickle, padding, buffers
+
+import os
+import mmap
+import struct
+import pickle
+
+MAGIC = b"SIMCKPT1"
+ALIGN = mmap.PAGESIZE
+
+def align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+def save(path, state):
+    """
+    Write state to path, replacing any previous checkpoint there only once
+    the new one is complete.
+    """
+    buffers = []
+    data = pickle.dumps(state, protocol=5, buffer_callback=buffers.append)
+    raws = [b.raw() for b in buffers]
+    headerSize = len(MAGIC) + struct.calcsize("<QQQ") + struct.calcsize("<QQ") * len(raws)
+    table = []
+    offset = align(headerSize + len(data))
+    for raw in raws:
+        table.append((offset, raw.nbytes))
+        offset = align(offset + raw.nbytes)
+
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + struct.pack("<QQQ", headerSize, len(data), len(raws)))
+        for entry in table:
+            f.write(struct.pack("<QQ", *entry))
+        f.write(data)
+        for ((start, length), raw) in zip(table, raws):
+            f.seek(start)
+            f.write(raw)
+        f.truncate(offset)
+    os.replace(tmp, path)
+
+def load(path, writable=True):
+    """
+    returns: the state saved to path. Out-of-band buffers are views of a
+    memory mapping of the file, copy-on-write if writable, read-only
+    otherwise.
+    """
+    with open(path, "rb") as f:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY if writable else mmap.ACCESS_READ)
+    if m[:len(MAGIC)] != MAGIC:
+        raise ValueError("%s is not a checkpoint" % path)
+    pos = len(MAGIC)
+    (start, length, count) = struct.unpack_from("<QQQ", m, pos)
+    pos += struct.calcsize("<QQQ")
+    view = memoryview(m)
+    buffers = []
+    for i in range(count):
+        (offset, size) = struct.unpack_from("<QQ", m, pos)
+        pos += struct.calcsize("<QQ")
+        buffers.append(view[offset:offset + size])
+    return pickle.loads(view[start:start + length], buffers=buffers)
@@ -0,0 +1,197 @@
+# Column-oriented history: one typed array per field instead of one object
+# per event, with aggregate queries done in NumPy. eventsim.py keeps every
+# peer's history this way. Agents still read it as the simulator's
+# per-round downloads/uploads lists, whose event objects are built on
+# demand, and can ask it for per-peer totals over a range of rounds
+# instead of looping over events.
+
+import numpy as np
+
+from messages import Download, Upload
+
+class EventColumns:
+    """
+    Growable int columns, one per field, of one kind of event. Peers are
+    stored as indices into the owning ColumnarHistory's peerIds list.
+    roundStart[r] is the position of the first event of round r, so any
+    range of rounds is a contiguous slice.
+    """
+    def __init__(self, fields, capacity=16):
+        self.fields = fields
+        self.size = 0
+        self.columns = dict((name, np.zeros(capacity, dtype=np.int32)) for name in fields)
+        self.roundStart = [0]
+
+    def rounds(self):
+        return len(self.roundStart) - 1
+
+    def padTo(self, round):
+        """
+        Open empty rounds until there are `round` of them.
+        """
+        while len(self.roundStart) <= round:
+            self.roundStart.append(self.size)
+
+    def append(self, values):
+        """
+        Add one event, given in the order of fields, to the latest round.
+        """
+        capacity = len(self.columns[self.fields[0]])
+        if self.size == capacity:
+            for name in self.fields:
+                bigger = np.zeros(2 * capacity, dtype=np.int32)
+                bigger[:capacity] = self.columns[name]
+                self.columns[name] = bigger
+        for (name, value) in zip(self.fields, values):
+            self.columns[name][self.size] = value
+        self.size += 1
+        self.roundStart[-1] = self.size
+
+    def span(self, a, b):
+        """
+        Slice of the events of rounds [a, b).
+        """
+        a = max(0, min(a, self.rounds()))
+        b = max(a, min(b, self.rounds()))
+        return slice(self.roundStart[a], self.roundStart[b])
+
+    def rows(self, r):
+        """
+        The events of round r, as lists of values in the order of fields.
+        """
+        s = slice(self.roundStart[r], self.roundStart[r + 1])
+        return zip(*[self.columns[name][s].tolist() for name in self.fields])
+
+class RoundList:
+    """
+    Read-only per-round list of event objects over EventColumns, indexed
+    and sliced like the simulator's history.downloads/history.uploads.
+    Each access builds fresh objects.
+    """
+    def __init__(self, columns, make):
+        self.columns = columns
+        self.make = make
+
+    def __len__(self):
+        return self.columns.rounds()
+
+    def round(self, r):
+        return [self.make(*row) for row in self.columns.rows(r)]
+
+    def __getitem__(self, r):
+        if isinstance(r, slice):
+            return [self.round(i) for i in range(*r.indices(len(self)))]
+        if r < 0:
+            r += len(self)
+        if not 0 <= r < len(self):
+            raise IndexError("round %d out of range" % r)
+        return self.round(r)
+
+    def __iter__(self):
+        for r in range(len(self)):
+            yield self.round(r)
+
+class ColumnarHistory:
+    """
+    One peer's history: downloads as (from, to, piece, blocks) and uploads
+    as (from, to, bw, actual) columns. Histories built with the same
+    peerIds list and peerIndex dict share them.
+    """
+    def __init__(self, peerIds=None, peerIndex=None):
+        self.peerIds = [] if peerIds is None else peerIds
+        if peerIndex is None:
+            peerIndex = dict((peerId, i) for (i, peerId) in enumerate(self.peerIds))
+        self.peerIndex = peerIndex
+        self.downloadColumns = EventColumns(("fromIdx", "toIdx", "piece", "blocks"))
+        self.uploadColumns = EventColumns(("fromIdx", "toIdx", "bw", "actual"))
+
+    def intern(self, peerId):
+        """
+        The column index used for peerId.
+        """
+        idx = self.peerIndex.get(peerId)
+        if idx is None:
+            idx = len(self.peerIds)
+            self.peerIndex[peerId] = idx
+            self.peerIds.append(peerId)
+        return idx
+
+    def padTo(self, round):
+        self.downloadColumns.padTo(round)
+        self.uploadColumns.padTo(round)
+
+    def currentRound(self):
+        return self.downloadColumns.rounds()
+
+    def addDownload(self, fromId, toId, piece, blocks):
+        """
+        Record a download in the latest round.
+        """
+        self.downloadColumns.append((self.intern(fromId), self.intern(toId), piece, blocks))
+
+    def addUpload(self, fromId, toId, bw, actual):
+        """
+        Record an upload of bw blocks, actual of them sent, in the latest round.
+        """
+        self.uploadColumns.append((self.intern(fromId), self.intern(toId), bw, actual))
+
+    def makeDownload(self, fromIdx, toIdx, piece, blocks):
+        return Download(self.peerIds[fromIdx], self.peerIds[toIdx], piece, blocks)
+
+    def makeUpload(self, fromIdx, toIdx, bw, actual):
+        u = Upload(self.peerIds[fromIdx], self.peerIds[toIdx], bw)
+        u.actual = actual
+        return u
+
+    @property
+    def downloads(self):
+        return RoundList(self.downloadColumns, self.makeDownload)
+
+    @property
+    def uploads(self):
+        return RoundList(self.uploadColumns, self.makeUpload)
+
+    def perPeer(self, columns, key, amount, a, b):
+        """
+        Sum of amount per peer index over rounds [a, b), as an array
+        indexed like peerIds.
+        """
+        if b is None:
+            b = columns.rounds()
+        s = columns.span(a, b)
+        return np.bincount(columns.columns[key][s], weights=columns.columns[amount][s],
+                           minlength=len(self.peerIds)).astype(np.int64)
+
+    def received(self, a=0, b=None):
+        """
+        Blocks received from each peer over rounds [a, b), as an array
+        indexed like peerIds. b defaults to the latest round.
+        """
+        return self.perPeer(self.downloadColumns, "fromIdx", "blocks", a, b)
+
+    def sent(self, a=0, b=None):
+        """
+        Blocks actually uploaded to each peer over rounds [a, b), indexed
+        like peerIds.
+        """
+        return self.perPeer(self.uploadColumns, "toIdx", "actual", a, b)
+
+    def toDict(self, counts):
+        """
+        {peerId: count} for the peers with a non-zero entry in counts.
+        """
+        return dict((self.peerIds[i], int(counts[i])) for i in np.flatnonzero(counts))
+
+    def receivedFrom(self, a=0, b=None):
+        """
+        {peerId: blocks received from it over rounds [a, b)}, non-zero only
+        """
+        return self.toDict(self.received(a, b))
+
+    def netBalance(self, a=0, b=None):
+        """
+        {peerId: blocks received from it - blocks uploaded to it} over
+        rounds [a, b), non-zero only. Over all rounds this is
+        DeficitLedger's balance.
+        """
+        return self.toDict(self.received(a, b) - self.sent(a, b))
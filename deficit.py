@@ -0,0 +1,95 @@
+# Deficit bookkeeping for the FairTorrent-style agents
+
+import heapq
+
+class DeficitLedger:
+    """
+    Running per-peer tally of blocks downloaded from a peer minus blocks
+    uploaded to it. Each update only folds in the rounds of history that
+    have not been seen yet, so keeping the ledger current is O(new events)
+    per round instead of a rescan of the whole history.
+    """
+    def __init__(self):
+        self.balance = dict()
+        self.downloadsSeen = 0
+        self.uploadsSeen = 0
+
+    def update(self, history):
+        """
+        history: the AgentHistory handed to the agent this round
+
+        Add the Download/Upload events from every round not yet seen.
+        """
+        downloads = history.downloads
+        uploads = history.uploads
+        # history only ever grows within a run; if it shrank we are looking
+        # at a new run and have to start over
+        if len(downloads) < self.downloadsSeen or len(uploads) < self.uploadsSeen:
+            self.__init__()
+
+        #collect blocks downloaded from each peer
+        for aRound in downloads[self.downloadsSeen:]:
+            for event in aRound:
+                self.balance[event.fromId] = self.balance.get(event.fromId, 0) + event.blocks
+        #subtract blocks uploaded to each peer
+        for aRound in uploads[self.uploadsSeen:]:
+            for event in aRound:
+                self.balance[event.toId] = self.balance.get(event.toId, 0) - event.actual
+
+        self.downloadsSeen = len(downloads)
+        self.uploadsSeen = len(uploads)
+
+    def get(self, peerId):
+        """
+        Blocks received from peerId minus blocks sent to it so far.
+        """
+        return self.balance.get(peerId, 0)
+
+def allocate(peerScores, requests, limit, blocksPerPiece, priority):
+    """
+    peerScores: [peerId, DF value, tie breaker] lists from sortPeerList()
+    requests: the requests made to this peer this round
+    limit: upload bandwidth to hand out
+    blocksPerPiece: blocks in a piece
+    priority: maps a peerScores entry to a heap key, smallest served first
+
+    returns: (list of peer ids, list of bandwidths), one pair per upload
+
+    Requesters are served in priority order, each getting the rest of the
+    piece it last asked for, and the order is repeated until the bandwidth
+    runs out. Requesters that could not take a single block are dropped up
+    front, so the loop always ends.
+    """
+    # the last request from each requester is the one that gets served
+    lastRequest = dict()
+    for request in requests:
+        lastRequest[request.requesterId] = request
+
+    queue = []
+    for x in peerScores:
+        current = lastRequest.get(x[0])
+        if current is not None and blocksPerPiece - current.start > 0:
+            queue.append((priority(x), x[0], blocksPerPiece - current.start))
+    heapq.heapify(queue)
+
+    uploadList = []
+    bws = []
+    # first pass in priority order, popping only as many as the bandwidth reaches
+    served = []
+    while limit > 0 and queue:
+        (key, peerId, bitsToUse) = heapq.heappop(queue)
+        b = min(bitsToUse, limit)
+        limit -= b
+        uploadList.append(peerId)
+        bws.append(b)
+        served.append((peerId, bitsToUse))
+    # every requester has been served once; go round again with what is left
+    while limit > 0 and served:
+        for (peerId, bitsToUse) in served:
+            if limit == 0:
+                break
+            b = min(bitsToUse, limit)
+            limit -= b
+            uploadList.append(peerId)
+            bws.append(b)
+    return (uploadList, bws)
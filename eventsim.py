@@ -0,0 +1,497 @@
+# Discrete-event simulator for the agent classes. It drives the same Peer
+# interface as sim.py (postInit, requests, uploads) and uses the same round
+# rules, but a peer's requests() or uploads() is only called when one of its
+# inputs changed since the last call:
+#  - requests(): its own pieces, its history, or a HAVE (another peer
+#    completing a piece this peer still needs). A peer that has every piece
+#    is never asked.
+#  - uploads(): the requests sent to it, its history, or a timer the agent
+#    declares: optimisticPeriod (BitTorrent's optimistic unchoke) and
+#    reciprocationWindow (a download dropping out of the window). The
+#    agents' uploads() only read peer ids from `peers`, which never change,
+#    so a HAVE does not wake it, unless the agent sets uploadsReadPieces
+#    (SuperSeed).
+# Otherwise the peer keeps its last requests and uploads, like a client
+# that only re-decides when something happens. Rounds where nothing
+# happens are skipped to the next timer, so sparse late-game rounds and
+# stalled swarms cost almost nothing.
+#
+# Run from the simulator directory (the agents need messages.py, util.py
+# and peer.py):
+#   python3 eventsim.py --numPieces=128 --blocksPerPiece=16 --minBw=16
+#       --maxBw=32 --maxRound=1000 Seed,2 BitTorrent,9 Freerider,1
+#
+# With --checkpoint=FILE the state is saved every --checkpointEvery rounds;
+# --resume=FILE continues a run bit for bit, and adding --reseed=N forks a
+# variant from that point instead. --trace=FILE records every call for
+# replay without the swarm (see calltrace.py). --heatmap=FILE draws who
+# unchoked whom (see exchanges.py).
+#
+# With --neighbors=K each peer only sees its neighbors (see neighbors.py),
+# refreshed every --refresh rounds, so an agent's cost no longer grows with
+# the swarm: its `peers` are its neighbors, a HAVE only wakes neighbors and
+# a refresh wakes the peers whose neighbors changed.
+#
+# Each peer's history is kept in NumPy columns (see columnar.py) rather
+# than as one object per event; the agents read it through the usual
+# per-round lists.
+
+import io
+import sys
+import heapq
+import random
+import importlib
+import contextlib
+from optparse import OptionParser
+
+from messages import PeerInfo
+from runner import formatSummary
+from metrics import agentType, Welford
+from rarity import sharedIndex
+from snapshot import PeerSnapshot
+from neighbors import NeighborTracker
+from columnar import ColumnarHistory
+from exchanges import ExchangeCounter, heatmap
+import checkpoint
+
+class Config:
+    def __init__(self, numPieces, blocksPerPiece, minBw, maxBw, maxRound):
+        self.numPieces = numPieces
+        self.blocksPerPiece = blocksPerPiece
+        self.minUpBw = minBw
+        self.maxUpBw = maxBw
+        self.maxRound = maxRound
+
+class PeerHistory:
+    """
+    One peer's downloads and uploads per round as plain lists, the history
+    interface the agents read, for wire.py and calltrace.py replays. The
+    swarm itself keeps a columnar.ColumnarHistory per peer. Rounds the peer
+    slept through are filled in with empty lists when it is next woken.
+    """
+    def __init__(self):
+        self.downloads = []
+        self.uploads = []
+
+    def padTo(self, round):
+        while len(self.downloads) < round:
+            self.downloads.append([])
+            self.uploads.append([])
+
+    def currentRound(self):
+        return len(self.downloads)
+
+def makeAgents(counts, conf, even=False):
+    """
+    counts: list of (agent class name, number of peers); the class is
+    loaded from the module of the same name in lower case. Seed, and any
+    class with startsFull set, starts with every piece.
+    even: seeds upload at maxUpBw and everyone else at the midpoint, as in
+    upBwEven(); otherwise bandwidths are uniform in [minUpBw, maxUpBw]
+
+    returns: the agent objects, built as sim.py builds them
+    """
+    agents = []
+    for (name, count) in counts:
+        cls = getattr(importlib.import_module(name.lower()), name)
+        for i in range(count):
+            full = name == "Seed" or getattr(cls, "startsFull", False)
+            pieces = [conf.blocksPerPiece if full else 0] * conf.numPieces
+            if even:
+                upBw = conf.maxUpBw if full else (conf.minUpBw + conf.maxUpBw) // 2
+            else:
+                upBw = random.randint(conf.minUpBw, conf.maxUpBw)
+            # keep the agents' postInit() chatter out of the output
+            with contextlib.redirect_stdout(io.StringIO()):
+                agents.append(cls(conf, "%s%d" % (name, i), pieces, upBw))
+    return agents
+
+class EventSim:
+    """
+    A swarm of agent objects, stepped round by round but woken by events.
+    """
+    def __init__(self, counts, numPieces, blocksPerPiece, minBw, maxBw,
+                 maxRound=1000, even=False, seed=None, neighbors=0, refresh=10):
+        """
+        counts, even: as for makeAgents
+        neighbors: if non-zero, the most neighbors a peer has, refreshed
+        every `refresh` rounds; otherwise every peer sees the whole swarm
+        """
+        random.seed(seed)
+        self.counts = counts
+        self.conf = Config(numPieces, blocksPerPiece, minBw, maxBw, maxRound)
+        self.peers = makeAgents(counts, self.conf, even)
+        self.byId = dict((p.id, p) for p in self.peers)
+        self.order = dict((p.id, i) for (i, p) in enumerate(self.peers))
+        # peers whose uploads() depend on the others' pieces
+        self.readPieces = set(p.id for p in self.peers if getattr(p, "uploadsReadPieces", False))
+        # every history shares one peer id table
+        ids = [p.id for p in self.peers]
+        index = dict((peerId, i) for (i, peerId) in enumerate(ids))
+        self.history = dict((p.id, ColumnarHistory(ids, index)) for p in self.peers)
+
+        self.info = dict()
+        self.missing = dict()
+        for p in self.peers:
+            self.info[p.id] = PeerInfo(p.id, [i for (i, b) in enumerate(p.pieces) if b == blocksPerPiece])
+            self.missing[p.id] = numPieces - len(self.info[p.id].availablePieces)
+        self.completion = dict((p.id, 0) for p in self.peers if self.missing[p.id] == 0)
+        self.uploaded = dict((p.id, 0) for p in self.peers)
+        # unchokes and blocks between every pair of peers
+        self.exchanges = ExchangeCounter()
+
+        # each peer's current requests, and the requests sent to each peer
+        # as {requesterId: [Request]}
+        self.requested = dict((p.id, []) for p in self.peers)
+        self.incoming = dict((p.id, dict()) for p in self.peers)
+        # each peer's current uploads, and the peers with any
+        self.uploading = dict((p.id, []) for p in self.peers)
+        self.active = set()
+        # heap of (round, peer index, peerId) uploads() timers, and the
+        # set of those pending so a timer is only set once
+        self.timers = []
+        self.pending = set()
+
+        self.tracker = None
+        if neighbors:
+            self.tracker = NeighborTracker([p.id for p in self.peers], neighbors,
+                                           refreshEvery=refresh, seed=seed)
+
+        self.round = 0
+        # peers whose history got a new event last round, the pieces some
+        # peer completed and who completed which, and the peers whose
+        # neighbors just changed
+        self.touched = set(self.byId)
+        self.completed = set(range(numPieces))
+        self.announced = dict()
+        self.rewired = set()
+        self.snapshot = PeerSnapshot(self.info[p.id] for p in self.peers)
+        self.calls = {"requests": 0, "uploads": 0}
+        # a calltrace.TraceWriter recording the calls, if any
+        self.trace = None
+
+    def done(self):
+        return len(self.completion) == len(self.peers)
+
+    def peerInfos(self, peerId):
+        """
+        returns: what peerId is handed as `peers`, a view of the round's
+        shared snapshot: everyone else, or only its neighbors
+        """
+        if self.tracker is not None:
+            return self.snapshot.among(self.tracker.of(peerId))
+        return self.snapshot.without(peerId)
+
+    def schedule(self, round, peerId):
+        if (round, peerId) not in self.pending:
+            self.pending.add((round, peerId))
+            heapq.heappush(self.timers, (round, self.order[peerId], peerId))
+
+    def dueTimers(self):
+        due = set()
+        while self.timers and self.timers[0][0] <= self.round:
+            (round, x, peerId) = heapq.heappop(self.timers)
+            self.pending.discard((round, peerId))
+            due.add(peerId)
+        return due
+
+    def wakeRequests(self):
+        """
+        Call requests() on every peer whose inputs changed and update the
+        requests sent to each peer.
+
+        returns: set of the peers with a new requester or one fewer
+        """
+        woken = set(peerId for peerId in (self.touched | self.rewired) if self.missing[peerId] > 0)
+        bpp = self.conf.blocksPerPiece
+        if self.tracker is not None:
+            # a HAVE only reaches the neighbors of the peer that sent it
+            for (announcer, pieces) in self.announced.items():
+                for peerId in self.tracker.of(announcer):
+                    p = self.byId[peerId]
+                    if self.missing[peerId] > 0 and any(p.pieces[i] < bpp for i in pieces):
+                        woken.add(peerId)
+        elif self.completed:
+            for p in self.peers:
+                if self.missing[p.id] > 0 and any(p.pieces[i] < bpp for i in self.completed):
+                    woken.add(p.id)
+        changed = set()
+        for peerId in sorted(woken, key=self.order.get):
+            p = self.byId[peerId]
+            history = self.history[p.id]
+            history.padTo(self.round)
+            self.calls["requests"] += 1
+            if self.trace is not None:
+                self.trace.begin()
+            requests = p.requests(self.peerInfos(p.id), history)
+            if self.trace is not None:
+                self.trace.end("R", self.round, p, history, None, requests)
+            self.setRequests(p.id, requests, changed)
+        # a peer that just finished withdraws its requests
+        for peerId in self.touched:
+            if self.missing[peerId] == 0 and self.requested[peerId]:
+                self.setRequests(peerId, [], changed)
+        return changed
+
+    def setRequests(self, peerId, requests, changed):
+        old = set(r.peerId for r in self.requested[peerId])
+        new = dict()
+        for r in requests:
+            new.setdefault(r.peerId, []).append(r)
+        # the agents' uploads() pick whom to unchoke by who is asking, so
+        # asking a peer for other pieces only changes what its current
+        # uploads serve
+        for target in set(old) - set(new):
+            del self.incoming[target][peerId]
+            changed.add(target)
+        for (target, mine) in new.items():
+            if target not in old:
+                changed.add(target)
+            self.incoming[target][peerId] = mine
+        self.requested[peerId] = requests
+
+    def wakeUploads(self, changed):
+        """
+        Call uploads() on every peer whose inputs changed or whose timer is
+        due, and keep the result until the next call.
+        """
+        due = self.dueTimers()
+        if self.round == 0:
+            woken = set(self.byId)
+        else:
+            woken = changed | due | self.rewired | set(peerId for peerId in self.touched if self.incoming[peerId])
+            if self.completed:
+                woken |= self.readPieces
+        for peerId in sorted(woken, key=self.order.get):
+            p = self.byId[peerId]
+            incoming = self.incoming[peerId]
+            requests = [r for requesterId in sorted(incoming, key=self.order.get)
+                        for r in incoming[requesterId]]
+            history = self.history[peerId]
+            history.padTo(self.round)
+            self.calls["uploads"] += 1
+            if self.trace is not None:
+                self.trace.begin()
+            uploads = p.uploads(requests, self.peerInfos(peerId), history)
+            if self.trace is not None:
+                self.trace.end("U", self.round, p, history, requests, uploads)
+            self.uploading[peerId] = uploads
+            if uploads:
+                self.active.add(peerId)
+            else:
+                self.active.discard(peerId)
+            period = getattr(p, "optimisticPeriod", None)
+            if period:
+                self.schedule((self.round // period + 1) * period, peerId)
+
+    def transfer(self):
+        """
+        Serve the current uploads as sim.py does: an upload to a peer fills
+        that peer's requests to the uploader, in order.
+        """
+        bpp = self.conf.blocksPerPiece
+        touched = set()
+        completed = set()
+        announced = dict()
+        transfers = []
+        for uploaderId in sorted(self.active, key=self.order.get):
+            for u in self.uploading[uploaderId]:
+                receiver = self.byId[u.toId]
+                left = u.bw
+                for r in self.incoming[uploaderId].get(u.toId, []):
+                    if left == 0:
+                        break
+                    blocks = min(left, bpp - receiver.pieces[r.pieceId])
+                    if blocks <= 0:
+                        continue
+                    left -= blocks
+                    receiver.pieces[r.pieceId] += blocks
+                    self.record(receiver.id).addDownload(uploaderId, receiver.id, r.pieceId, blocks)
+                    touched.add(receiver.id)
+                    if receiver.pieces[r.pieceId] == bpp:
+                        self.info[receiver.id] = PeerInfo(
+                            receiver.id, self.info[receiver.id].availablePieces + [r.pieceId])
+                        self.missing[receiver.id] -= 1
+                        completed.add(r.pieceId)
+                        announced.setdefault(receiver.id, []).append(r.pieceId)
+                        if self.missing[receiver.id] == 0:
+                            self.completion[receiver.id] = self.round
+                # the history keeps the blocks that were actually sent, as
+                # sim.py does; DeficitLedger reads them
+                self.record(uploaderId).addUpload(uploaderId, u.toId, u.bw, u.bw - left)
+                self.uploaded[uploaderId] += u.bw - left
+                transfers.append((uploaderId, u.toId, u.bw - left))
+                touched.add(uploaderId)
+        self.exchanges.recordRound(transfers)
+        # a download now leaves the reciprocation window later on
+        for peerId in touched:
+            window = getattr(self.byId[peerId], "reciprocationWindow", None)
+            if window:
+                self.schedule(self.round + window + 1, peerId)
+        self.touched = touched
+        self.completed = completed
+        self.announced = announced
+        if completed:
+            self.snapshot = PeerSnapshot((self.info[p.id] for p in self.peers), self.snapshot)
+            if self.trace is not None:
+                self.trace.have(self.info)
+
+    def record(self, peerId):
+        history = self.history[peerId]
+        history.padTo(self.round + 1)
+        return history
+
+    def step(self):
+        if self.tracker is not None:
+            self.rewired = self.tracker.refresh(self.round)
+            if self.rewired and self.trace is not None:
+                self.trace.neighbors(self.tracker, self.rewired)
+        changed = self.wakeRequests()
+        self.wakeUploads(changed)
+        self.transfer()
+        self.round += 1
+        if not (self.touched or self.completed or self.active):
+            # nothing can change until the next timer or refresh, if any
+            wake = self.conf.maxRound
+            if self.timers:
+                wake = min(wake, max(self.round, self.timers[0][0]))
+            if self.tracker is not None:
+                wake = min(wake, self.tracker.nextRefresh(self.round - 1))
+            self.round = wake
+
+    def run(self, checkpointPath=None, checkpointEvery=0):
+        """
+        Step until every peer is done or maxRound, saving a checkpoint to
+        checkpointPath every checkpointEvery rounds if given.
+        """
+        last = self.round
+        while self.round < self.conf.maxRound and not self.done():
+            self.step()
+            if checkpointPath is not None and self.round - last >= checkpointEvery:
+                self.save(checkpointPath)
+                last = self.round
+        return self
+
+    def save(self, path):
+        """
+        Checkpoint the swarm along with the module-level state the agents
+        share: the random module's state and rarity.sharedIndex. A trace
+        being recorded is not part of it.
+        """
+        (trace, self.trace) = (self.trace, None)
+        try:
+            checkpoint.save(path, {"sim": self, "random": random.getstate(), "rarity": sharedIndex})
+        finally:
+            self.trace = trace
+
+    @staticmethod
+    def load(path, reseed=None):
+        """
+        returns: the EventSim saved to path, with the shared state restored,
+        ready to run() on from where it stopped. With reseed, the random
+        module is reseeded so that runs forked from one checkpoint differ.
+        """
+        state = checkpoint.load(path)
+        random.setstate(state["random"])
+        # the agent modules hold references to sharedIndex itself
+        sharedIndex.__dict__.update(state["rarity"].__dict__)
+        sim = state["sim"]
+        if reseed is not None:
+            random.seed(reseed)
+            if sim.tracker is not None:
+                sim.tracker.rng.seed(reseed)
+        return sim
+
+    def bandwidths(self):
+        return dict((p.id, p.upBw) for p in self.peers)
+
+    def summary(self, byType=True):
+        """
+        returns: {section: {name: (avg, stddev)}} in the layout used by
+        runner.formatSummary, per agent type or per peer. Peers that never
+        finished are left out of the completion rounds.
+        """
+        summary = {"Upload bandwidth": dict(), "Completion rounds": dict()}
+        for (section, values) in (("Upload bandwidth", self.uploaded),
+                                  ("Completion rounds", self.completion)):
+            groups = dict()
+            for (peerId, value) in values.items():
+                name = agentType(peerId) if byType else peerId
+                groups.setdefault(name, Welford()).add(value)
+            for (name, w) in groups.items():
+                summary[section][name] = (w.mean, w.stddev())
+        return summary
+
+def main(args):
+    usage_msg = "Usage:  %prog [options] PeerClass1,count PeerClass2,count ..."
+    parser = OptionParser(usage=usage_msg)
+    parser.add_option("--numPieces", dest="numPieces", default=128, type="int")
+    parser.add_option("--blocksPerPiece", dest="blocksPerPiece", default=16, type="int")
+    parser.add_option("--minBw", dest="minBw", default=16, type="int")
+    parser.add_option("--maxBw", dest="maxBw", default=32, type="int")
+    parser.add_option("--maxRound", dest="maxRound", default=None, type="int",
+                      help="last round (default 1000, or the checkpoint's with --resume)")
+    parser.add_option("--even", dest="even", default=False, action="store_true",
+                      help="bandwidths as set by upBwEven()")
+    parser.add_option("--seed", dest="seed", default=None, type="int")
+    parser.add_option("--perPeer", dest="perPeer", default=False, action="store_true",
+                      help="report every peer instead of every agent type")
+    parser.add_option("--checkpoint", dest="checkpoint", default=None,
+                      help="save the simulation state to this file as it runs")
+    parser.add_option("--checkpointEvery", dest="checkpointEvery", default=50, type="int",
+                      help="rounds between checkpoints")
+    parser.add_option("--resume", dest="resume", default=None,
+                      help="continue from this checkpoint instead of a new swarm")
+    parser.add_option("--reseed", dest="reseed", default=None, type="int",
+                      help="with --resume, fork the run with this new random seed")
+    parser.add_option("--trace", dest="trace", default=None,
+                      help="record every requests() and uploads() call to this file")
+    parser.add_option("--neighbors", dest="neighbors", default=0, type="int",
+                      help="most neighbors each peer sees (0: the whole swarm)")
+    parser.add_option("--refresh", dest="refresh", default=10, type="int",
+                      help="rounds between neighbor refreshes")
+    parser.add_option("--heatmap", dest="heatmap", default=None,
+                      help="draw the unchoke counts into this image")
+    parser.add_option("--sortby", dest="sortby", default=None,
+                      help="heatmap order: bandwidth (default) or alpha")
+    (options, mix) = parser.parse_args(args)
+
+    if options.resume is not None:
+        sim = EventSim.load(options.resume, options.reseed)
+        if options.maxRound is not None:
+            sim.conf.maxRound = options.maxRound
+    else:
+        counts = []
+        for entry in mix:
+            (name, count) = entry.split(",")
+            counts.append((name, int(count)))
+        if len(counts) == 0:
+            parser.error("need at least one PeerClass,count")
+        if options.maxRound is None:
+            options.maxRound = 1000
+        sim = EventSim(counts, options.numPieces, options.blocksPerPiece, options.minBw,
+                       options.maxBw, options.maxRound, options.even, options.seed,
+                       options.neighbors, options.refresh)
+    if options.trace is not None:
+        # calltrace imports this module for Config and PeerHistory
+        from calltrace import TraceWriter
+        sim.trace = TraceWriter(options.trace, sim, options.seed)
+    sim.run(options.checkpoint, options.checkpointEvery)
+    if sim.trace is not None:
+        sim.trace.close()
+    rounds = max(sim.completion.values()) + 1 if sim.done() else sim.round
+    title = " ".join("%s,%d" % (name, count) for (name, count) in sim.counts)
+    print(formatSummary("%s (%d rounds)" % (title, rounds),
+                        sim.summary(not options.perPeer)))
+    if options.heatmap is not None:
+        heatmap(sim.exchanges.unchokes, options.heatmap, sim.bandwidths(),
+                options.sortby, title="unchokes, %s (%d rounds)" % (title, rounds))
+    lockstep = rounds * len(sim.peers)
+    print("Calls: requests %d, uploads %d (lock-step: %d each)" % (
+        sim.calls["requests"], sim.calls["uploads"], lockstep))
+    unfinished = len(sim.peers) - len(sim.completion)
+    if unfinished:
+        print("Unfinished peers: %d" % unfinished)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,120 @@
+# Unchoke and block exchange counts kept as the rounds happen, stored
+# sparsely as {(A, B): count} (the shape stats.unchokeCount returns), and
+# heatmaps of them that group peers by agent type or bandwidth bucket when
+# the swarm is too big to show one row per peer.
+
+import math
+
+from metrics import agentType
+
+class ExchangeCounter:
+    """
+    unchokes[(A, B)]: rounds in which A uploaded to B
+    blocks[(A, B)]: blocks B received from A
+    """
+    def __init__(self):
+        self.unchokes = dict()
+        self.blocks = dict()
+
+    def add(self, table, a, b, n):
+        table[(a, b)] = table.get((a, b), 0) + n
+
+    def recordRound(self, transfers):
+        """
+        transfers: one round's uploads as (A, B, blocks actually sent). A
+        peer uploading to another several times in a round is one unchoke.
+        Costs O(transfers), so it can be called every round.
+        """
+        pairs = set()
+        for (a, b, n) in transfers:
+            pairs.add((a, b))
+            if n:
+                self.add(self.blocks, a, b, n)
+        for (a, b) in pairs:
+            self.add(self.unchokes, a, b, 1)
+
+def aggregate(counts, groupOf):
+    """
+    counts: {(A, B): count}
+    groupOf: maps a peer id to its group label
+
+    returns: {(group of A, group of B): summed count}
+    """
+    grouped = dict()
+    for ((a, b), n) in counts.items():
+        key = (groupOf(a), groupOf(b))
+        grouped[key] = grouped.get(key, 0) + n
+    return grouped
+
+def bandwidthBuckets(bandwidths, buckets):
+    """
+    bandwidths: {peerId: upload bandwidth}
+
+    returns: a function mapping a peer id to a "lo-hi" bandwidth range
+    label (just "lo" for ranges of one), with at most `buckets` ranges
+    over the bandwidths seen
+    """
+    lo = min(bandwidths.values())
+    hi = max(bandwidths.values())
+    width = max(1, int(math.ceil((hi - lo + 1) / float(buckets))))
+
+    def bucketOf(peerId):
+        start = lo + (bandwidths[peerId] - lo) // width * width
+        if width == 1:
+            return "%d" % start
+        return "%d-%d" % (start, start + width - 1)
+    return bucketOf
+
+def heatmap(counts, path, bandwidths=None, sortby=None, maxLabels=60, title=None):
+    """
+    Draw counts as a heatmap (rows upload, columns download) into path.
+
+    sortby=None orders peers by bandwidth, sortby="alpha" alphabetically,
+    which groups them by type, as stats.frequencyMap does. With more than
+    maxLabels peers they are grouped: by agent type for "alpha", by
+    bandwidth bucket otherwise. Only the grouped matrix is ever dense.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    peers = set()
+    for (a, b) in counts:
+        peers.add(a)
+        peers.add(b)
+    if bandwidths is None:
+        sortby = "alpha"
+
+    if len(peers) > maxLabels:
+        if sortby == "alpha":
+            groupOf = agentType
+        else:
+            groupOf = bandwidthBuckets(dict((p, bandwidths[p]) for p in peers), maxLabels)
+        counts = aggregate(counts, groupOf)
+        labels = sorted(set(groupOf(p) for p in peers),
+                        key=lambda x: x if sortby == "alpha" else int(x.split("-")[0]))
+    elif sortby == "alpha":
+        labels = sorted(peers)
+    else:
+        labels = sorted(peers, key=lambda p: (bandwidths[p], p))
+
+    index = dict((label, i) for (i, label) in enumerate(labels))
+    matrix = [[0] * len(labels) for label in labels]
+    for ((a, b), n) in counts.items():
+        matrix[index[a]][index[b]] += n
+
+    size = max(6, len(labels) * 0.25)
+    fig, ax = plt.subplots(figsize=(size, size))
+    image = ax.imshow(matrix, cmap="viridis")
+    ax.set_xticks(range(len(labels)))
+    ax.set_yticks(range(len(labels)))
+    ax.set_xticklabels(labels, rotation=90)
+    ax.set_yticklabels(labels)
+    ax.set_xlabel("downloading peer")
+    ax.set_ylabel("uploading peer")
+    if title is not None:
+        ax.set_title(title)
+    fig.colorbar(image, ax=ax)
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
@@ -6,10 +6,13 @@
 import random
 import logging
 
-from messages import Upload, Request
-from util import evenSplit
+from messages import Request
 from peer import Peer
+from instrument import instrumented
+from bitfield import toBits, pieceIds
+from snapshot import bitsOf
 
+@instrumented
 class Freerider(Peer):
     def postInit(self):  
         print("postInit(): %s here!" % self.id)
@@ -25,11 +28,13 @@ class Freerider(Peer):
         """
         needed = lambda i: self.pieces[i] < self.conf.blocksPerPiece
         neededPieces = filter(needed, range(len(self.pieces)))
-        npSet = set(neededPieces)  # sets support fast intersection ops
+        npBits = toBits(neededPieces)  # bitfields support fast intersection ops
 
 
-        logging.debug("%s here: still need pieces %s" % (
-            self.id, list(neededPieces)))
+        # only build the piece lists when someone will read them
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        if debug:
+            logging.debug("%s here: still need pieces %s", self.id, pieceIds(npBits))
 
         #logging.debug("%s still here. Here are some peers:" % self.id)
         #for p in peers:
@@ -43,13 +48,12 @@ class Freerider(Peer):
         random.shuffle(list(neededPieces))
         
         # Sort peers by id.  This is probably not a useful sort, but other 
-        # sorts might be useful
-        peers.sort(key=lambda p: p.id)
+        # sorts might be useful. peers is shared with the other agents, so
+        # sort a copy.
         # request all available pieces from all peers
         # can request up to self.maxRequests from each
-        for peer in peers:
-            avSet = set(peer.availablePieces)
-            isect = avSet.intersection(npSet)
+        for peer in sorted(peers, key=lambda p: p.id):
+            isect = pieceIds(npBits & bitsOf(peer))
             n = min(self.maxRequests, len(isect))
             # More symmetry breaking -- ask for random pieces.
             # This would be the place to try fancier piece-requesting strategies
@@ -75,8 +79,7 @@ class Freerider(Peer):
         """
 
         round = history.currentRound()
-        logging.debug("%s again.  It's round %d." % (
-            self.id, round))
+        logging.debug("%s again.  It's round %d.", self.id, round)
         
             
         return [] 
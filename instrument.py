@@ -0,0 +1,140 @@
+# Opt-in timing of the agents' hot paths. Run with AGENT_PROFILE=<prefix>
+# (e.g. AGENT_PROFILE=profile python3 sim.py ...) to record wall time, call
+# counts and input sizes of requests(), uploads() and sortPeerList() for
+# every agent class, per round and per iteration, written to <prefix>.json
+# and <prefix>.csv when the process exits (sortPeerList time is also part
+# of the uploads() that calls it). Without it @instrumented hands
+# the class back untouched, so there is no cost at all.
+
+import os
+import csv
+import json
+import time
+import atexit
+import functools
+
+METHODS = ("requests", "uploads", "sortPeerList")
+
+FIELDS = ["iteration", "round", "agent", "method", "calls", "seconds",
+          "peers", "requests", "historyEvents"]
+
+class Profiler:
+    """
+    Sums of calls, time and sizes per (iteration, round, class, method).
+    """
+    def __init__(self):
+        self.iteration = 0
+        self.lastRound = -1
+        self.records = dict()
+        # agent id -> [rounds counted, events in them], see historyEvents()
+        self.seen = dict()
+
+    def record(self, agent, method, roundNum, seconds, peers, requests, historyEvents):
+        # rounds only go back when the simulator starts a new iteration
+        if roundNum < self.lastRound:
+            self.iteration += 1
+        self.lastRound = roundNum
+        key = (self.iteration, roundNum, agent, method)
+        r = self.records.get(key)
+        if r is None:
+            r = [0, 0.0, 0, 0, 0]
+            self.records[key] = r
+        r[0] += 1
+        r[1] += seconds
+        r[2] += peers
+        r[3] += requests
+        r[4] += historyEvents
+
+    def rows(self):
+        """
+        returns: one dict per (iteration, round, class, method), in order
+        """
+        return [dict(zip(FIELDS, list(key) + r)) for (key, r) in sorted(self.records.items())]
+
+    def perIteration(self):
+        """
+        returns: the rows summed over rounds, one per (iteration, class, method)
+        """
+        totals = dict()
+        for row in self.rows():
+            key = (row["iteration"], row["agent"], row["method"])
+            t = totals.setdefault(key, dict(iteration=key[0], agent=key[1], method=key[2],
+                                            rounds=0, calls=0, seconds=0.0, peers=0,
+                                            requests=0, historyEvents=0))
+            t["rounds"] += 1
+            for field in ("calls", "seconds", "peers", "requests", "historyEvents"):
+                t[field] += row[field]
+        return [totals[key] for key in sorted(totals)]
+
+    def write(self, prefix):
+        rows = self.rows()
+        with open(prefix + ".json", "w") as f:
+            json.dump({"rounds": rows, "iterations": self.perIteration()}, f, indent=1)
+        with open(prefix + ".csv", "w") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def historyEvents(self, agentId, history):
+        """
+        Events in an agent's history, kept as a running count that only
+        adds the rounds completed since the agent's last call, so profiling
+        a run stays linear in its length. A history shorter than the rounds
+        counted belongs to a new iteration, and is counted from the start.
+        """
+        seen = self.seen.get(agentId)
+        rounds = len(history.downloads)
+        if seen is None or rounds < seen[0]:
+            seen = [0, 0]
+            self.seen[agentId] = seen
+        for r in range(seen[0], rounds):
+            seen[1] += len(history.downloads[r]) + len(history.uploads[r])
+        seen[0] = rounds
+        return seen[1]
+
+def wrap(cls, name):
+    """
+    Replace cls.name with a version that reports to the profiler.
+    """
+    fn = cls.__dict__[name]
+
+    @functools.wraps(fn)
+    def timed(self, *args):
+        start = time.perf_counter()
+        result = fn(self, *args)
+        seconds = time.perf_counter() - start
+        # the arguments are (peers, history) or (requests, peers, history)
+        history = args[-1]
+        peers = args[-2]
+        requests = args[0] if len(args) == 3 else ()
+        profiler.record(cls.__name__, name, history.currentRound(), seconds,
+                        len(peers), len(requests), profiler.historyEvents(self.id, history))
+        return result
+
+    setattr(cls, name, timed)
+
+def instrumented(cls):
+    """
+    Class decorator for agents; a no-op unless profiling is switched on.
+    """
+    if profiler is None:
+        return cls
+    for name in METHODS:
+        if name in cls.__dict__:
+            wrap(cls, name)
+    return cls
+
+def enable(prefix):
+    """
+    Switch profiling on from code. Has to happen before the agent modules
+    are imported.
+    """
+    global profiler
+    if profiler is None:
+        profiler = Profiler()
+        atexit.register(lambda: profiler.write(prefix))
+    return profiler
+
+profiler = None
+if os.environ.get("AGENT_PROFILE"):
+    enable(os.environ["AGENT_PROFILE"])
@@ -0,0 +1,202 @@
+# Streaming metrics. Records are appended to a JSON lines file as soon as
+# they are produced and folded into running (Welford) mean/stddev
+# aggregates, so memory stays bounded however long the sweep is, and a
+# partial or crashed run can still be summarised from its file:
+#   python3 metrics.py runner_metrics.jsonl [--byType]
+
+import re
+import sys
+import json
+import math
+from optparse import OptionParser
+
+class Welford:
+    """
+    Running count, mean and population stddev (the one used in DATA) of a
+    stream of values.
+    """
+    __slots__ = ("count", "mean", "m2")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    def stddev(self):
+        if self.count == 0:
+            return 0.0
+        return math.sqrt(self.m2 / self.count)
+
+    def halfWidth(self):
+        """
+        Half the width of a 95% confidence interval on the mean, from the
+        sample stddev and Student's t. Infinite below two values.
+        """
+        if self.count < 2:
+            return float("inf")
+        df = self.count - 1
+        t = T95[max(d for d in T95 if d <= df)]
+        return t * math.sqrt(self.m2 / df / self.count)
+
+# two-sided 95% Student t quantiles by degrees of freedom; in between, the
+# next lower entry is used, which only widens the interval
+T95 = {1: 12.71, 2: 4.30, 3: 3.18, 4: 2.78, 5: 2.57, 6: 2.45, 7: 2.36, 8: 2.31,
+       9: 2.26, 10: 2.23, 12: 2.18, 15: 2.13, 20: 2.09, 30: 2.04, 60: 2.00, 120: 1.98}
+
+def agentType(peerId):
+    """
+    The agent class of a simulator peer id, e.g. FairTorrent3 -> FairTorrent.
+    """
+    return re.sub(r"[0-9]+$", "", peerId)
+
+class MetricsSink:
+    """
+    Per-iteration and per-round records for any number of configurations,
+    with running aggregates per peer and per agent type. path=None keeps
+    the aggregates without writing anything.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.file = None
+        if path is not None:
+            self.file = open(path, "a")
+        self.perPeer = dict()     # (config, section, peerId) -> Welford
+        self.perType = dict()     # (config, section, agent type) -> Welford
+        # (config, section, agent type) -> Welford of each iteration's mean
+        # over the peers of that type, the independent samples for intervals
+        self.perIteration = dict()
+        self.iterations = dict()  # config -> iterations folded in
+        self.folded = set()       # (config, iteration) of those
+
+    def write(self, record):
+        if self.file is not None:
+            self.file.write(json.dumps(record, sort_keys=True) + "\n")
+            # flush every record so a crash loses at most the one in flight
+            self.file.flush()
+
+    def addIteration(self, config, iteration, stats):
+        """
+        iteration: names the iteration within config; runner.py and
+        popsim.py use its seed
+        stats: {section: {peerId: value}} for one finished iteration. An
+        iteration already folded in is not written or counted again.
+        """
+        if (config, iteration) in self.folded:
+            return
+        self.write({"kind": "iteration", "config": config, "iteration": iteration, "stats": stats})
+        self.fold(config, iteration, stats)
+
+    def addRound(self, config, roundNum, values):
+        """
+        values: any small JSON-serialisable per-round record
+        """
+        self.write({"kind": "round", "config": config, "round": roundNum, "values": values})
+
+    def fold(self, config, iteration, stats):
+        """
+        Add one iteration to the aggregates, unless it is already in them.
+        """
+        if (config, iteration) in self.folded:
+            return
+        self.folded.add((config, iteration))
+        self.iterations[config] = self.iterations.get(config, 0) + 1
+        for (section, values) in stats.items():
+            byType = dict()
+            for (peerId, value) in values.items():
+                self.aggregate(self.perPeer, (config, section, peerId)).add(value)
+                self.aggregate(self.perType, (config, section, agentType(peerId))).add(value)
+                byType.setdefault(agentType(peerId), []).append(value)
+            for (name, typeValues) in byType.items():
+                self.aggregate(self.perIteration, (config, section, name)).add(
+                    sum(typeValues) / len(typeValues))
+
+    def aggregate(self, table, key):
+        w = table.get(key)
+        if w is None:
+            w = Welford()
+            table[key] = w
+        return w
+
+    def configs(self):
+        """
+        Configurations in the order they were first seen.
+        """
+        return list(self.iterations)
+
+    def summary(self, config, byType=False):
+        """
+        returns: {section: {name: (avg, stddev)}} for runner.formatSummary
+        """
+        table = self.perType if byType else self.perPeer
+        summary = dict()
+        for ((c, section, name), w) in table.items():
+            if c == config:
+                summary.setdefault(section, dict())[name] = (w.mean, w.stddev())
+        return summary
+
+    def intervals(self, config, section):
+        """
+        returns: {agent type: (mean, 95% CI half width)} of the per-iteration
+        means of section
+        """
+        return dict((name, (w.mean, w.halfWidth()))
+                    for ((c, s, name), w) in self.perIteration.items()
+                    if c == config and s == section)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def readMetrics(path):
+    """
+    Rebuild the aggregates from a metrics file, ignoring a last line that
+    was cut short by a crash. An iteration written more than once, as when
+    runner.py appends a rerun (cached or not) to the same file, counts once.
+
+    returns: (a MetricsSink that does not write, {config: round records})
+    """
+    sink = MetricsSink()
+    rounds = dict()
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("kind") == "iteration":
+                sink.fold(record["config"], record["iteration"], record["stats"])
+            elif record.get("kind") == "round":
+                rounds[record["config"]] = rounds.get(record["config"], 0) + 1
+    return (sink, rounds)
+
+def main(args):
+    from runner import formatSummary
+
+    parser = OptionParser(usage="Usage:  %prog [options] METRICS_FILE")
+    parser.add_option("--byType", dest="byType", default=False, action="store_true",
+                      help="aggregate over every peer of an agent type")
+    (options, paths) = parser.parse_args(args)
+    if len(paths) != 1:
+        parser.error("need exactly one metrics file")
+
+    (sink, rounds) = readMetrics(paths[0])
+    tables = [formatSummary("%s (%d iterations)" % (config, sink.iterations[config]),
+                            sink.summary(config, options.byType))
+              for config in sink.configs()]
+    # e.g. a popsim.py run that is still going or died before its end
+    for config in rounds:
+        if config not in sink.iterations:
+            tables.append("%s: %d rounds, no finished iterations" % (config, rounds[config]))
+    if not tables:
+        tables.append("no iteration or round records in %s" % paths[0])
+    print("\n~~~\n\n".join(tables))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
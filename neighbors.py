@@ -0,0 +1,87 @@
+# Tracker-style neighbor sets: each peer is connected to at most `size`
+# others instead of the whole swarm, as real clients cap their connections
+# (about 50). Connections are symmetric. Every `refreshEvery` rounds each
+# peer drops `churn` of its connections at random and every peer with room
+# asks the tracker for more, so the sets keep mixing.
+
+import random
+
+class NeighborTracker:
+    """
+    Bounded, symmetric, periodically refreshed neighbor sets over a fixed
+    list of peer ids.
+    """
+    def __init__(self, peerIds, size, refreshEvery=10, churn=1, seed=None):
+        self.ids = list(peerIds)
+        self.size = size
+        self.refreshEvery = refreshEvery
+        self.churn = churn
+        self.rng = random.Random(seed)
+        self.neighbors = dict((peerId, set()) for peerId in self.ids)
+        self.fill(self.ids)
+
+    def connect(self, a, b):
+        self.neighbors[a].add(b)
+        self.neighbors[b].add(a)
+
+    def disconnect(self, a, b):
+        self.neighbors[a].discard(b)
+        self.neighbors[b].discard(a)
+
+    def fill(self, peerIds):
+        """
+        Top up the given peers with random peers that have room, as a
+        tracker announce would. A peer can end up short when few peers have
+        room left; the next refresh tries again.
+
+        returns: set of the peers that got a new neighbor
+        """
+        changed = set()
+        if self.size >= len(self.ids) - 1:
+            # small swarm: everyone sees everyone
+            for a in peerIds:
+                for b in self.ids:
+                    if b != a and b not in self.neighbors[a]:
+                        self.connect(a, b)
+                        changed.update((a, b))
+            return changed
+        order = list(peerIds)
+        self.rng.shuffle(order)
+        for a in order:
+            tries = 0
+            # random picks rather than a scan of the swarm, so a fill costs
+            # O(size) per peer whatever the swarm size
+            while len(self.neighbors[a]) < self.size and tries < 4 * self.size:
+                tries += 1
+                b = self.rng.choice(self.ids)
+                if b != a and b not in self.neighbors[a] and len(self.neighbors[b]) < self.size:
+                    self.connect(a, b)
+                    changed.update((a, b))
+        return changed
+
+    def refresh(self, round):
+        """
+        Drop and replace connections if a refresh is due this round.
+
+        returns: set of the peers whose neighbors changed
+        """
+        if round == 0 or round % self.refreshEvery != 0 or self.size >= len(self.ids) - 1:
+            return set()
+        changed = set()
+        for a in self.ids:
+            if len(self.neighbors[a]) < self.size:
+                continue
+            for b in self.rng.sample(sorted(self.neighbors[a]), min(self.churn, len(self.neighbors[a]))):
+                self.disconnect(a, b)
+                changed.update((a, b))
+        changed |= self.fill([a for a in self.ids if len(self.neighbors[a]) < self.size])
+        return changed
+
+    def nextRefresh(self, round):
+        """
+        returns: the first refresh round after round
+        """
+        return (round // self.refreshEvery + 1) * self.refreshEvery
+
+    def of(self, peerId):
+        return self.neighbors[peerId]
@@ -0,0 +1,85 @@
+# Request planning for the rarest-first agents. Instead of every peer being
+# asked for the same rarest pieces, the pieces we still need are spread
+# over the peers that have them, and the last few pieces go to endgame mode.
+
+import random
+
+from messages import Request
+from bitfield import pieceIds, count
+
+# with this many pieces or fewer left, ask every holder for every piece
+ENDGAME_PIECES = 4
+
+def desireRank(pieces, desireList):
+    """
+    Partly downloaded pieces first, most complete first, then the rest in
+    desireList (rarest first) order.
+
+    returns: {pieceId: position}
+    """
+    partial = [pieceId for pieceId in desireList if pieces[pieceId] > 0]
+    partial.sort(key=lambda pieceId: -pieces[pieceId])
+    fresh = [pieceId for pieceId in desireList if pieces[pieceId] == 0]
+    return dict((pieceId, x) for (x, pieceId) in enumerate(partial + fresh))
+
+def planRequests(agent, peers, index, npBits, desireList):
+    """
+    agent: the requesting agent (uses id, pieces and maxRequests)
+    peers: the PeerInfo list handed to requests()
+    index: the RarityIndex holding every peer's pieces
+    npBits: bitfield of the pieces agent still needs
+    desireList: the needed pieces, rarest first
+
+    returns: a list of Request() objects
+
+    Each peer is asked for up to maxRequests pieces. Outside endgame the
+    peers take turns picking their most wanted piece that nobody else has
+    been asked for, so the first requests to different peers never overlap.
+    The simulator serves a peer's requests in order, so a peer that runs
+    out of such pieces is only then given ones already asked of someone
+    else, to use spare bandwidth. In endgame every peer is asked for the
+    remaining pieces it has.
+    """
+    rank = desireRank(agent.pieces, desireList)
+    holders = []
+    for peer in peers:
+        held = pieceIds(npBits & index.bitsOf(peer.id))
+        if held:
+            held.sort(key=rank.__getitem__)
+            holders.append((peer.id, held))
+    # symmetry breaking: who picks first changes every round
+    random.shuffle(holders)
+
+    n = agent.maxRequests
+    plan = dict((peerId, []) for (peerId, held) in holders)
+    if count(npBits) <= ENDGAME_PIECES:
+        for (peerId, held) in holders:
+            plan[peerId] = held[:n]
+    else:
+        assigned = set()
+        cursor = dict((peerId, 0) for (peerId, held) in holders)
+        for turn in range(n):
+            for (peerId, held) in holders:
+                c = cursor[peerId]
+                while c < len(held) and held[c] in assigned:
+                    c += 1
+                if c < len(held):
+                    assigned.add(held[c])
+                    plan[peerId].append(held[c])
+                    c += 1
+                cursor[peerId] = c
+        # top up with pieces already asked of someone else
+        for (peerId, held) in holders:
+            mine = plan[peerId]
+            if len(mine) < n:
+                asked = set(mine)
+                mine.extend([pieceId for pieceId in held if pieceId not in asked][:n - len(mine)])
+
+    requests = []
+    for (peerId, held) in holders:
+        for pieceId in plan[peerId]:
+            # which part of the piece do we need next?
+            # (must get the next-needed blocks in order)
+            startBlock = agent.pieces[pieceId]
+            requests.append(Request(agent.id, peerId, pieceId, startBlock))
+    return requests
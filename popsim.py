@@ -0,0 +1,438 @@
+# Population-vectorized simulator. Whole swarms of the stock strategies are
+# held as NumPy arrays (piece matrix, per-neighbor deficit and reciprocation
+# matrices, unchoke masks) and each strategy takes one vectorized step per
+# round, so swarms of 10,000+ peers run on one machine.
+#
+# Example:
+#   python3 popsim.py --numPieces=128 --blocksPerPiece=16 --minBw=16 --maxBw=32
+#       --maxRound=1000 Seed,20 BitTorrent,5000 FairTorrent,5000 Freerider,100
+#
+# With --checkpoint=FILE the population is saved every --checkpointEvery
+# rounds, its arrays memory-mappable; --resume=FILE continues a run bit for
+# bit, and adding --reseed=N forks a variant from that point instead.
+#
+# Differences from sim.py and the agent classes, which keep this tractable:
+#  - every peer sees a fixed random set of `neighbors` peers instead of the
+#    whole swarm (real clients cap their connections the same way)
+#  - a peer asks each neighbor for up to maxRequests pieces per round (as
+#    many as any bandwidth could serve, as in peer.Peer), the rarest ones
+#    that neighbor has, with ties broken randomly per peer
+#  - rarity is counted over the whole swarm, as in rarity.sharedIndex
+
+import sys
+from optparse import OptionParser
+
+import numpy as np
+
+from runner import formatSummary
+from metrics import MetricsSink
+from exchanges import ExchangeCounter, heatmap
+import checkpoint
+
+STRATEGIES = ["Seed", "BitTorrent", "FairTorrent", "AngwyTorrent", "Freerider"]
+SEED, BITTORRENT, FAIRTORRENT, ANGWYTORRENT, FREERIDER = range(len(STRATEGIES))
+
+# BitTorrent: unchoke slots (including the optimistic one), optimistic
+# rotation period and reciprocation window, as in bittorrent.py
+UNCHOKE_SLOTS = 4
+OPTIMISTIC_PERIOD = 3
+
+def neighborRings(n, neighbors, rng):
+    """
+    returns: ((n, k) array of neighbor indices, k <= neighbors and even,
+    (n, k) bool array of the slots in use)
+
+    Built from k/2 random rings over all peers: on each ring a peer is
+    linked to the next and previous peer. Slot 2r holds the next peer on
+    ring r and slot 2r+1 the previous one, so if j is in slot s of i then
+    i is in slot s ^ 1 of j. A link to a peer already linked on an earlier
+    ring (or, with two peers, the second link of the only ring) is left
+    out at both ends, so no peer sees a neighbor twice.
+    """
+    rings = max(1, min(neighbors // 2, (n - 1) // 2))
+    nbr = np.empty((n, 2 * rings), dtype=np.int64)
+    for r in range(rings):
+        perm = rng.permutation(n)
+        nbr[perm, 2 * r] = np.roll(perm, -1)
+        nbr[perm, 2 * r + 1] = np.roll(perm, 1)
+    # every link once, from the peer it is the next slot of: a -> nbr[a, 2r]
+    a = np.tile(np.arange(n), rings)
+    ring = np.repeat(np.arange(rings), n)
+    b = nbr[a, 2 * ring]
+    (lo, hi) = (np.minimum(a, b), np.maximum(a, b))
+    order = np.lexsort((a, ring, hi, lo))
+    repeat = np.zeros(len(a), dtype=bool)
+    repeat[order[1:]] = (lo[order[1:]] == lo[order[:-1]]) & (hi[order[1:]] == hi[order[:-1]])
+    repeat |= a == b
+    alive = np.ones(nbr.shape, dtype=bool)
+    alive[a[repeat], 2 * ring[repeat]] = False
+    alive[b[repeat], 2 * ring[repeat] + 1] = False
+    return (nbr, alive)
+
+def evenSplitMask(chosen, upBw, demand):
+    """
+    Split each row's upBw evenly over the chosen slots (as util.evenSplit
+    does), capped at what each slot asked for.
+    """
+    count = chosen.sum(1)
+    safe = np.maximum(count, 1)
+    base = upBw // safe
+    extra = upBw % safe
+    rank = np.cumsum(chosen, 1) - 1
+    share = base[:, None] + (rank < extra[:, None])
+    return np.where(chosen, np.minimum(share, demand), 0)
+
+def greedyFill(key, upBw, demand):
+    """
+    Hand each row's upBw to its slots in ascending key order, each slot
+    taking up to its demand, like deficit.allocate() does for one peer.
+    """
+    order = np.argsort(key, axis=1, kind="stable")
+    wanted = np.take_along_axis(demand, order, 1)
+    before = np.cumsum(wanted, 1) - wanted
+    given = np.clip(upBw[:, None] - before, 0, wanted)
+    alloc = np.zeros_like(demand)
+    np.put_along_axis(alloc, order, given, 1)
+    return alloc
+
+class Population:
+    """
+    A swarm of stock-strategy peers. Peer i is ids[i], of strategy kind[i].
+    """
+    def __init__(self, counts, numPieces, blocksPerPiece, minBw, maxBw,
+                 neighbors=50, window=5, even=False, seed=None):
+        """
+        counts: list of (strategy name, number of peers)
+        even: seeds upload at maxBw and everyone else at the midpoint, as
+        in upBwEven(); otherwise bandwidths are uniform in [minBw, maxBw]
+        """
+        self.rng = np.random.default_rng(seed)
+        # names the run in metrics records, so that repeats of a seeded run
+        # count once; an unseeded run gets a random name
+        self.seed = seed
+        self.counts = counts
+        ids = []
+        kinds = []
+        for (name, count) in counts:
+            ids += ["%s%d" % (name, i) for i in range(count)]
+            kinds += [STRATEGIES.index(name)] * count
+        self.ids = ids
+        self.kind = np.array(kinds, dtype=np.int8)
+        n = len(ids)
+
+        self.blocksPerPiece = blocksPerPiece
+        self.blocks = np.zeros((n, numPieces), dtype=np.int16)
+        self.blocks[self.kind == SEED] = blocksPerPiece
+        if even:
+            self.upBw = np.where(self.kind == SEED, maxBw, (minBw + maxBw) // 2)
+        else:
+            self.upBw = self.rng.integers(minBw, maxBw + 1, size=n)
+        self.upBw = self.upBw.astype(np.int64)
+
+        (self.nbr, self.alive) = neighborRings(n, neighbors, self.rng)
+        k = self.nbr.shape[1]
+        self.rev = np.arange(k) ^ 1
+        # blocks received from / sent to each neighbor slot since the start
+        self.received = np.zeros((n, k), dtype=np.int64)
+        self.sent = np.zeros((n, k), dtype=np.int64)
+        # rounds each peer uploaded to each neighbor slot
+        self.unchoked = np.zeros((n, k), dtype=np.int64)
+        # blocks received per neighbor slot over the last `window` rounds
+        self.window = np.zeros((window, n, k), dtype=np.int64)
+        self.recent = np.zeros((n, k), dtype=np.int64)
+        self.optimistic = np.zeros(n, dtype=np.int64)
+
+        # as in peer.Peer: more requests than this could never be served
+        self.maxRequests = min(maxBw // blocksPerPiece + 1, numPieces)
+
+        self.round = 0
+        self.uploaded = np.zeros(n, dtype=np.int64)
+        self.completion = np.where(self.kind == SEED, 0, -1)
+
+    def requests(self):
+        """
+        returns: (n, k, maxRequests) array, the pieces each peer asks each
+        neighbor slot for, most wanted first, padded with -1
+        """
+        (n, numPieces) = self.blocks.shape
+        have = self.blocks == self.blocksPerPiece
+        needed = ~have
+        active = (self.kind != SEED) & needed.any(1)
+        # rarest first, ties broken randomly per peer
+        score = have.sum(0)[None, :] + self.rng.random((n, numPieces))
+        r = self.maxRequests
+        pieces = np.full(self.nbr.shape + (r,), -1, dtype=np.int64)
+        for slot in range(self.nbr.shape[1]):
+            candidates = needed & have[self.nbr[:, slot]]
+            masked = np.where(candidates, score, np.inf)
+            best = np.argpartition(masked, r - 1, axis=1)[:, :r]
+            bestScore = np.take_along_axis(masked, best, 1)
+            order = np.argsort(bestScore, axis=1)
+            best = np.take_along_axis(best, order, 1)
+            ok = (active & self.alive[:, slot])[:, None] & np.isfinite(
+                np.take_along_axis(bestScore, order, 1))
+            pieces[:, slot] = np.where(ok, best, -1)
+        return pieces
+
+    def unchokeSlots(self, eligible, key):
+        """
+        Pick up to UNCHOKE_SLOTS eligible slots per row: the ones with the
+        largest key, ties broken randomly.
+        """
+        key = np.where(eligible, key + self.rng.random(eligible.shape), -np.inf)
+        top = np.argsort(-key, axis=1, kind="stable")[:, :UNCHOKE_SLOTS]
+        chosen = np.zeros(eligible.shape, dtype=bool)
+        np.put_along_axis(chosen, top, True, 1)
+        return chosen & eligible
+
+    def rotateOptimistic(self, rows):
+        """
+        Give each row a new random non-seed neighbor slot in use. Rows that
+        only see seeds give up after a few tries instead of looping forever.
+        """
+        k = self.nbr.shape[1]
+        pick = self.rng.integers(0, k, size=len(rows))
+        for attempt in range(8):
+            retry = (self.kind[self.nbr[rows, pick]] == SEED) | ~self.alive[rows, pick]
+            if not retry.any():
+                break
+            pick[retry] = self.rng.integers(0, k, size=retry.sum())
+        self.optimistic[rows] = pick
+
+    def uploads(self, pieces):
+        """
+        pieces: the output of requests()
+
+        returns: (blocks still missing of each requested piece, (n, k, r),
+        and blocks uploaded per slot, (n, k)), seen from the uploader's side
+        """
+        incoming = pieces[self.nbr, self.rev[None, :]]
+        requesting = incoming[:, :, 0] >= 0
+        held = self.blocks[self.nbr[:, :, None], np.maximum(incoming, 0)]
+        missing = np.where(incoming >= 0, self.blocksPerPiece - held, 0).astype(np.int64)
+        demand = missing.sum(2)
+        alloc = np.zeros_like(demand)
+
+        rows = np.flatnonzero(self.kind == SEED)
+        if len(rows):
+            chosen = self.unchokeSlots(requesting[rows], 0.0)
+            alloc[rows] = evenSplitMask(chosen, self.upBw[rows], demand[rows])
+
+        rows = np.flatnonzero(self.kind == BITTORRENT)
+        if len(rows):
+            if self.round % OPTIMISTIC_PERIOD == 0:
+                self.rotateOptimistic(rows)
+            recent = self.recent[rows]
+            optimistic = np.zeros(recent.shape, dtype=bool)
+            optimistic[np.arange(len(rows)), self.optimistic[rows]] = True
+            # regular slots only go to peers that gave us something lately;
+            # the optimistic slot always makes the cut if it asked for something
+            eligible = requesting[rows] & ((recent > 0) | optimistic)
+            chosen = self.unchokeSlots(eligible, np.where(optimistic, 1e18, recent))
+            alloc[rows] = evenSplitMask(chosen, self.upBw[rows], demand[rows])
+
+        for (strategy, sign) in ((FAIRTORRENT, -1), (ANGWYTORRENT, 1)):
+            rows = np.flatnonzero(self.kind == strategy)
+            if len(rows):
+                deficit = self.received[rows] - self.sent[rows]
+                key = sign * deficit + self.rng.random(deficit.shape)
+                alloc[rows] = greedyFill(key, self.upBw[rows], demand[rows])
+
+        return (missing, alloc)
+
+    def step(self):
+        """
+        Run one round: requests, uploads, then the transfers.
+        """
+        pieces = self.requests()
+        (missing, alloc) = self.uploads(pieces)
+        # each slot's blocks go to the requested pieces in order, as sim.py
+        # serves a requester's requests in order
+        before = np.cumsum(missing, 2) - missing
+        given = np.clip(alloc[:, :, None] - before, 0, missing)
+        (src, slot, r) = np.nonzero(given)
+        dst = self.nbr[src, slot]
+        incoming = pieces[dst, self.rev[slot], r]
+        np.add.at(self.blocks, (dst, incoming), given[src, slot, r].astype(np.int16))
+        np.minimum(self.blocks, self.blocksPerPiece, out=self.blocks)
+
+        self.uploaded += alloc.sum(1)
+        self.sent += alloc
+        self.unchoked += alloc > 0
+        got = np.zeros_like(self.received)
+        (src, slot) = np.nonzero(alloc)
+        np.add.at(got, (self.nbr[src, slot], self.rev[slot]), alloc[src, slot])
+        self.received += got
+        w = self.round % len(self.window)
+        self.recent += got - self.window[w]
+        self.window[w] = got
+
+        finished = (self.completion < 0) & (self.blocks == self.blocksPerPiece).all(1)
+        self.completion[finished] = self.round
+        self.round += 1
+
+    def done(self):
+        return bool((self.completion >= 0).all())
+
+    def run(self, maxRound, sink=None, config=None, checkpointPath=None, checkpointEvery=0):
+        """
+        Step until every peer is done or maxRound. With a sink, a record of
+        the blocks uploaded and peers finished per strategy is written
+        after every round, and the whole run as one iteration at the end,
+        numbered by its seed.
+        With checkpointPath, the population is saved there every
+        checkpointEvery rounds.
+        """
+        last = self.round
+        while self.round < maxRound and not self.done():
+            uploaded = self.uploaded.copy() if sink is not None else None
+            self.step()
+            if sink is not None:
+                sink.addRound(config, self.round - 1, self.roundRecord(self.uploaded - uploaded))
+            if checkpointPath is not None and self.round - last >= checkpointEvery:
+                checkpoint.save(checkpointPath, self)
+                last = self.round
+        if sink is not None:
+            iteration = self.seed
+            if iteration is None:
+                iteration = int(np.random.default_rng().integers(2 ** 62))
+            sink.addIteration(config, iteration, self.iterationStats())
+        return self
+
+    @staticmethod
+    def load(path, reseed=None):
+        """
+        returns: the Population saved to path, its arrays mapped copy-on-write
+        from the file. With reseed, it gets a new random generator so that
+        runs forked from one checkpoint differ.
+        """
+        population = checkpoint.load(path)
+        if reseed is not None:
+            population.rng = np.random.default_rng(reseed)
+            population.seed = reseed
+        return population
+
+    def roundRecord(self, uploaded):
+        record = dict()
+        for (code, name) in enumerate(STRATEGIES):
+            mask = self.kind == code
+            if mask.any():
+                record[name] = {"uploaded": int(uploaded[mask].sum()),
+                                "finished": int((self.completion[mask] >= 0).sum())}
+        return record
+
+    def iterationStats(self):
+        """
+        returns: {section: {peerId: value}}, the run as one iteration in the
+        form MetricsSink.addIteration takes. Peers that never finished are
+        left out of the completion rounds.
+        """
+        finished = self.completion >= 0
+        return {"Upload bandwidth": dict(zip(self.ids, (int(x) for x in self.uploaded))),
+                "Completion rounds": dict((self.ids[i], int(self.completion[i]))
+                                          for i in np.flatnonzero(finished))}
+
+    def exchanges(self):
+        """
+        returns: an ExchangeCounter with the unchokes and blocks sent so far.
+        The per-slot counters are kept as the rounds run; this only turns
+        their non-zero entries into the sparse {(A, B): count} form.
+        """
+        counter = ExchangeCounter()
+        for (table, counts) in ((counter.unchokes, self.unchoked), (counter.blocks, self.sent)):
+            (src, slot) = np.nonzero(counts)
+            for (a, b, c) in zip(src, self.nbr[src, slot], counts[src, slot]):
+                key = (self.ids[a], self.ids[b])
+                table[key] = table.get(key, 0) + int(c)
+        return counter
+
+    def bandwidths(self):
+        return dict(zip(self.ids, (int(bw) for bw in self.upBw)))
+
+    def summary(self, byType=True):
+        """
+        returns: {section: {name: (avg, stddev)}} in the layout used by
+        runner.formatSummary, per strategy or per peer. Peers that never
+        finished are left out of the completion rounds.
+        """
+        summary = {"Upload bandwidth": dict(), "Completion rounds": dict()}
+        if byType:
+            groups = [(name, self.kind == code) for (code, name) in enumerate(STRATEGIES)
+                      if (self.kind == code).any()]
+        else:
+            groups = [(peerId, np.arange(len(self.ids)) == i) for (i, peerId) in enumerate(self.ids)]
+        for (name, mask) in groups:
+            up = self.uploaded[mask]
+            summary["Upload bandwidth"][name] = (float(up.mean()), float(up.std()))
+            rounds = self.completion[mask]
+            rounds = rounds[rounds >= 0]
+            if len(rounds):
+                summary["Completion rounds"][name] = (float(rounds.mean()), float(rounds.std()))
+        return summary
+
+def main(args):
+    usage_msg = "Usage:  %prog [options] PeerClass1,count PeerClass2,count ..."
+    parser = OptionParser(usage=usage_msg)
+    parser.add_option("--numPieces", dest="numPieces", default=128, type="int")
+    parser.add_option("--blocksPerPiece", dest="blocksPerPiece", default=16, type="int")
+    parser.add_option("--minBw", dest="minBw", default=16, type="int")
+    parser.add_option("--maxBw", dest="maxBw", default=32, type="int")
+    parser.add_option("--maxRound", dest="maxRound", default=1000, type="int")
+    parser.add_option("--neighbors", dest="neighbors", default=50, type="int")
+    parser.add_option("--window", dest="window", default=5, type="int",
+                      help="BitTorrent reciprocation window in rounds")
+    parser.add_option("--even", dest="even", default=False, action="store_true",
+                      help="bandwidths as set by upBwEven()")
+    parser.add_option("--seed", dest="seed", default=None, type="int")
+    parser.add_option("--perPeer", dest="perPeer", default=False, action="store_true",
+                      help="report every peer instead of every strategy")
+    parser.add_option("--metrics", dest="metrics", default=None,
+                      help="append per-round records, and the run as one iteration, to this JSON lines file")
+    parser.add_option("--heatmap", dest="heatmap", default=None,
+                      help="draw the unchoke counts into this image")
+    parser.add_option("--sortby", dest="sortby", default=None,
+                      help="heatmap order: bandwidth (default) or alpha")
+    parser.add_option("--checkpoint", dest="checkpoint", default=None,
+                      help="save the population to this file as it runs")
+    parser.add_option("--checkpointEvery", dest="checkpointEvery", default=50, type="int",
+                      help="rounds between checkpoints")
+    parser.add_option("--resume", dest="resume", default=None,
+                      help="continue from this checkpoint instead of a new population")
+    parser.add_option("--reseed", dest="reseed", default=None, type="int",
+                      help="with --resume, fork the run with this new random seed")
+    (options, mix) = parser.parse_args(args)
+
+    if options.resume is not None:
+        population = Population.load(options.resume, options.reseed)
+    else:
+        counts = []
+        for entry in mix:
+            (name, count) = entry.split(",")
+            if name not in STRATEGIES:
+                parser.error("unknown strategy %s, expected one of %s" % (name, ", ".join(STRATEGIES)))
+            counts.append((name, int(count)))
+        if len(counts) == 0:
+            parser.error("need at least one PeerClass,count")
+        population = Population(counts, options.numPieces, options.blocksPerPiece,
+                                options.minBw, options.maxBw, options.neighbors,
+                                options.window, options.even, options.seed)
+    config = " ".join("%s,%d" % (name, count) for (name, count) in population.counts)
+    sink = None
+    if options.metrics is not None:
+        sink = MetricsSink(options.metrics)
+    try:
+        population.run(options.maxRound, sink, config, options.checkpoint, options.checkpointEvery)
+    finally:
+        if sink is not None:
+            sink.close()
+    title = "%s (%d rounds)" % (config, population.round)
+    print(formatSummary(title, population.summary(not options.perPeer)))
+    if options.heatmap is not None:
+        heatmap(population.exchanges().unchokes, options.heatmap, population.bandwidths(),
+                options.sortby, title="unchokes, " + title)
+    unfinished = int((population.completion < 0).sum())
+    if unfinished:
+        print("Unfinished peers: %d" % unfinished)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,133 @@
+# A proportional-share uploader after Levin et al., "BitTorrent is an
+# Auction: Analyzing and Improving BitTorrent's Incentives"
+# (papers/BitTorrentAuctionLevin08.pdf).
+#
+# Each round most of the upload bandwidth is divided among the requesters
+# that gave us blocks over the last `reciprocationWindow` rounds, in
+# proportion to what each gave. The rest, `optimisticShare` of it, goes to
+# one requester picked at random, so that newcomers can get started; with
+# no contributors at all it is split evenly over the requesters. Nobody is
+# given more than the blocks it asked us for; the excess goes to the others
+# in the same proportions. Requests are the rarest-first planner of the
+# other agents.
+
+import random
+import logging
+
+from messages import Upload
+from peer import Peer
+from instrument import instrumented
+from rarity import sharedIndex
+from bitfield import toBits, fullBits, pieceIds
+from planner import planRequests
+from reciprocation import ReciprocationTracker
+
+def proportionalSplit(total, weights, caps):
+    """
+    Split up to `total` blocks in proportion to weights, giving nobody more
+    than its cap; what a capped share cannot use goes to the others in the
+    same proportions.
+
+    returns: list of ints, each at most its cap
+    """
+    exact = [0.0] * len(weights)
+    open_ = [i for i in range(len(weights)) if caps[i] > 0]
+    left = float(total)
+    while open_ and left > 1e-9:
+        scale = left / sum(weights[i] for i in open_)
+        full = [i for i in open_ if exact[i] + weights[i] * scale >= caps[i]]
+        if not full:
+            for i in open_:
+                exact[i] += weights[i] * scale
+            break
+        for i in full:
+            left -= caps[i] - exact[i]
+            exact[i] = caps[i]
+        open_ = [i for i in open_ if i not in full]
+    shares = [int(x) for x in exact]
+    # hand the rounding remainder to the largest fractional parts
+    spare = min(total, sum(caps)) - sum(shares)
+    for i in sorted(range(len(weights)), key=lambda i: shares[i] - exact[i]):
+        if spare <= 0:
+            break
+        if shares[i] < caps[i]:
+            shares[i] += 1
+            spare -= 1
+    return shares
+
+@instrumented
+class PropShare(Peer):
+    # rounds of downloads that count as a contribution
+    reciprocationWindow = 5
+    # fraction of upBw kept for an optimistic unchoke
+    optimisticShare = 0.2
+
+    def postInit(self):
+        print("postInit(): %s here!" % self.id)
+        self.tracker = ReciprocationTracker(self.reciprocationWindow)
+
+    def requests(self, peers, history):
+        """
+        peers: available info about the peers (who has what pieces)
+        history: what's happened so far as far as this peer can see
+
+        returns: a list of Request() objects
+
+        This will be called after updatePieces() with the most recent state.
+        """
+        needed = lambda i: self.pieces[i] < self.conf.blocksPerPiece
+        npBits = toBits(filter(needed, range(len(self.pieces))))
+
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("%s here: still need pieces %s", self.id, pieceIds(npBits))
+
+        # rarest-first order of the pieces we still need, kept once for the whole swarm
+        sharedIndex.update(peers)
+        sharedIndex.observeBits(self.id, fullBits(len(self.pieces)) & ~npBits)
+        desireList = sharedIndex.desireOrder(npBits)
+
+        # spread the pieces over the peers that have them; endgame at the end
+        return planRequests(self, peers, sharedIndex, npBits, desireList)
+
+    def uploads(self, requests, peers, history):
+        """
+        requests -- a list of the requests for this peer for this round
+        peers -- available info about all the peers
+        history -- history for all previous rounds
+
+        returns: list of Upload objects.
+
+        In each round, this will be called after requests().
+        """
+        round = history.currentRound()
+        logging.debug("%s again.  It's round %d.", self.id, round)
+        self.tracker.update(history)
+        if len(requests) == 0:
+            return []
+
+        # blocks each requester could take from us this round
+        demand = dict()
+        for r in requests:
+            demand[r.requesterId] = demand.get(r.requesterId, 0) + self.conf.blocksPerPiece - r.start
+        requesters = sorted(demand)
+        received = self.tracker.received()
+        contributors = [j for j in requesters if j in received]
+
+        if not contributors:
+            # nobody has given us anything yet: bootstrap everyone asking
+            uploadList = requesters
+            bws = proportionalSplit(self.upBw, [1] * len(requesters),
+                                    [demand[j] for j in requesters])
+        else:
+            weights = dict((j, received[j]) for j in contributors)
+            # the optimistic unchoke: any requester, so that a peer that
+            # never gives is not the sure winner of it
+            lucky = random.choice(requesters)
+            weights[lucky] = (weights.get(lucky, 0) +
+                              sum(weights.values()) * self.optimisticShare / (1 - self.optimisticShare))
+            uploadList = sorted(weights)
+            bws = proportionalSplit(self.upBw, [weights[j] for j in uploadList],
+                                    [demand[j] for j in uploadList])
+
+        logging.debug("Still here: uploading %s", uploadList)
+        return [Upload(self.id, peerId, bw) for (peerId, bw) in zip(uploadList, bws) if bw > 0]
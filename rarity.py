@@ -0,0 +1,111 @@
+# Swarm-wide piece rarity shared by the rarest-first agents
+
+import random
+
+from bitfield import toBits, pieceIds, count
+
+class RarityIndex:
+    """
+    Keeps a count of how many peers hold each piece, updated only from the
+    pieces that changed since the last look, and a cached grouping of the
+    pieces by that count that is rebuilt at most once per change instead of
+    once per agent. Peer availability is kept as bitfields (see bitfield.py).
+    """
+    def __init__(self):
+        self.available = dict()  # peerId -> bitfield of pieces it holds
+        self.sizes = dict()      # peerId -> number of pieces it holds
+        self.counts = dict()     # pieceId -> number of peers holding it
+        self.order = None        # bitfields of pieces grouped by count, None when stale
+        self.seen = None         # the last PeerSnapshot taken in whole
+
+    def reset(self):
+        """
+        Forget everything, e.g. when a new simulation run starts.
+        """
+        self.__init__()
+
+    def observe(self, peerId, availablePieces, bits=None):
+        """
+        Record the pieces a single peer currently holds. Peers only ever
+        gain pieces, so a peer whose piece count did not change is skipped
+        and otherwise only the new pieces are counted.
+
+        returns: True if the index had to be reset
+        """
+        if len(availablePieces) == self.sizes.get(peerId, 0):
+            return False
+        if bits is None:
+            bits = toBits(availablePieces)
+        return self.observeBits(peerId, bits)
+
+    def observeBits(self, peerId, bits):
+        """
+        Same as observe(), for a peer whose pieces are already a bitfield.
+        """
+        known = self.available.get(peerId, 0)
+        if bits == known:
+            return False
+        if known & ~bits:
+            # a peer lost pieces, which only happens when a new run starts
+            self.reset()
+            self.observeBits(peerId, bits)
+            return True
+        for pieceId in pieceIds(bits & ~known):
+            self.counts[pieceId] = self.counts.get(pieceId, 0) + 1
+        self.available[peerId] = bits
+        self.sizes[peerId] = count(bits)
+        self.order = None
+        return False
+
+    def update(self, peers):
+        """
+        peers: the PeerInfo list handed to requests(), or a view of a
+        PeerSnapshot (see snapshot.py). A snapshot is only read once, by
+        the first agent handed a view of it.
+        """
+        snapshot = getattr(peers, "snapshot", None)
+        if snapshot is not None:
+            if snapshot is self.seen:
+                return
+            peers = snapshot
+        for p in peers:
+            if self.observe(p.id, p.availablePieces, getattr(p, "bits", None)):
+                # the index was reset part way through, start over
+                return self.update(peers)
+        self.seen = snapshot
+
+    def bitsOf(self, peerId):
+        """
+        Bitfield of the pieces peerId held when it was last observed.
+        """
+        return self.available.get(peerId, 0)
+
+    def rarityClasses(self):
+        """
+        Bitfields of the pieces held by at least one peer, grouped by how
+        many peers hold them, least common group first.
+        """
+        if self.order is None:
+            byCount = dict()
+            for pieceId, pieceCount in self.counts.items():
+                byCount.setdefault(pieceCount, []).append(pieceId)
+            self.order = [toBits(byCount[c]) for c in sorted(byCount)]
+        return self.order
+
+    def desireOrder(self, neededBits):
+        """
+        neededBits: bitfield of the pieces the caller still needs
+
+        returns: the needed pieces that someone holds, rarest first
+        """
+        desireList = []
+        for rarityClass in self.rarityClasses():
+            wanted = pieceIds(rarityClass & neededBits)
+            # ties are broken per caller, otherwise every agent would chase
+            # the same piece
+            random.shuffle(wanted)
+            desireList.extend(wanted)
+        return desireList
+
+# one index for the whole swarm; every agent in the process shares it
+sharedIndex = RarityIndex()
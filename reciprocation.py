@@ -0,0 +1,51 @@
+# Sliding-window record of how many blocks each peer has given us
+
+import collections
+
+class ReciprocationTracker:
+    """
+    Blocks received from each peer over the last `window` rounds. Every
+    round is added once and subtracted once when it leaves the window, so
+    the cost is O(1) per Download event.
+    """
+    def __init__(self, window=5):
+        self.window = window
+        self.recent = collections.deque()  # one {peerId: blocks} per round in the window
+        self.totals = dict()
+        self.roundsSeen = 0
+
+    def update(self, history):
+        """
+        history: the AgentHistory handed to the agent this round
+        """
+        downloads = history.downloads
+        if len(downloads) < self.roundsSeen:
+            # history only grows within a run, so this is a new run
+            self.__init__(self.window)
+        for aRound in downloads[self.roundsSeen:]:
+            self.addRound(aRound)
+        self.roundsSeen = len(downloads)
+
+    def addRound(self, aRound):
+        """
+        Slide the window forward by one round of Download events.
+        """
+        received = dict()
+        for move in aRound:
+            received[move.fromId] = received.get(move.fromId, 0) + move.blocks
+            self.totals[move.fromId] = self.totals.get(move.fromId, 0) + move.blocks
+        self.recent.append(received)
+        if len(self.recent) > self.window:
+            for (peerId, blocks) in self.recent.popleft().items():
+                left = self.totals[peerId] - blocks
+                if left == 0:
+                    del self.totals[peerId]
+                else:
+                    self.totals[peerId] = left
+
+    def received(self):
+        """
+        {peerId: blocks received over the window}, peers that gave nothing
+        are left out
+        """
+        return self.totals
@@ -0,0 +1,326 @@
+# Runs a grid of simulator configurations, fanning the iterations out over
+# a process pool, and merges the per-iteration stats into the avg (stddev)
+# tables found in DATA.
+#
+# Example, from the simulator directory:
+#   python3 runner.py --numPieces=128 --blocksPerPiece=16 --minBw=16 --maxBw=32
+#       --maxRound=1000 --iters=32 --bwModes=uniform,even
+#       "Seed,2 BitTorrent,9 Freerider,1" "Seed,2 FairTorrent,5 AngwyTorrent,5"
+#
+# With --ciWidth, --ciUpload or --separate the iterations run in batches
+# and a configuration stops as soon as its confidence intervals are narrow
+# or apart enough; --iters is then the most it gets.
+
+import sys
+import os
+import re
+import zlib
+import subprocess
+from optparse import OptionParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from cache import ResultCache, sourceHash
+from metrics import MetricsSink
+
+# options passed straight through to sim.py
+SIM_OPTIONS = ["numPieces", "blocksPerPiece", "minBw", "maxBw", "maxRound"]
+
+# bandwidth modes: "uniform" is sim.py's own draw in [minBw, maxBw], "even"
+# the bandwidths upBwEven() sets
+BW_MODES = ["uniform", "even"]
+
+# Run by simCommand() with python -c, as
+#   <sim.py> <seed> <mode> <minBw> <maxBw> <sim.py arguments ...>
+# sim.py has no seed option, so random is seeded before it is loaded. In
+# "even" mode the simulator's per-peer draw, Sim.upBw(peerId), is replaced
+# by the upBwEven() values (seeds at maxBw, everyone else at the midpoint)
+# before its main() runs.
+SIM_WRAPPER = """
+import os
+import sys
+import random
+import runpy
+(sim, seed, mode, minBw, maxBw) = sys.argv[1:6]
+(minBw, maxBw) = (int(minBw), int(maxBw))
+sys.argv = [sim] + sys.argv[6:]
+sys.path.insert(0, os.path.dirname(os.path.abspath(sim)))
+random.seed(int(seed))
+if mode != "even":
+    runpy.run_path(sim, run_name="__main__")
+    sys.exit(0)
+module = runpy.run_path(sim, run_name="sim")
+if not hasattr(module.get("Sim"), "upBw"):
+    sys.exit("%s: no Sim.upBw(peerId) to set even bandwidths through" % sim)
+def upBw(self, peerId, *args, **kwargs):
+    return maxBw if "Seed" in peerId else (minBw + maxBw) // 2
+module["Sim"].upBw = upBw
+module["main"](sys.argv)
+"""
+
+# the stats sections printed by sim.py, in the order they appear in DATA
+SECTIONS = ["Upload bandwidth", "Completion rounds"]
+
+_STAT_LINE = re.compile(r"^(\S+): (-?[0-9.]+)\s+\((-?[0-9.]+)\)$")
+
+def iterationSeed(baseSeed, iteration):
+    """
+    Deterministic seed for one iteration. It does not depend on the agent
+    mix, so every configuration sees the same sequence of seeds.
+    """
+    return zlib.crc32(("%d:%d" % (baseSeed, iteration)).encode())
+
+def simCommand(options, mix, mode, seed):
+    """
+    The command line running a single iteration of one configuration:
+    sim.py under SIM_WRAPPER, which seeds it and sets the bandwidth mode.
+    """
+    command = [sys.executable, "-c", SIM_WRAPPER, options.sim, str(seed), mode,
+               str(options.minBw), str(options.maxBw)]
+    for name in SIM_OPTIONS:
+        command.append("--%s=%s" % (name, getattr(options, name)))
+    command.append("--iters=1")
+    return command + mix.split()
+
+def parseStats(output):
+    """
+    output: the text sim.py printed
+
+    returns: {section: {peerId: value}} for every section in SECTIONS. With
+    --iters=1 the avg column is the value for that single iteration.
+    """
+    stats = dict((section, dict()) for section in SECTIONS)
+    current = None
+    for line in output.splitlines():
+        line = line.strip()
+        header = line.split(":")[0]
+        if header in stats and line.endswith("avg (stddev)"):
+            current = stats[header]
+            continue
+        match = _STAT_LINE.match(line)
+        if current is not None and match:
+            current[match.group(1)] = float(match.group(2))
+        else:
+            current = None
+    return stats
+
+def runIteration(job):
+    """
+    job: (mix, mode, iteration, command)
+
+    returns: (job, parsed stats). Runs in a worker process.
+    """
+    (mix, mode, iteration, command) = job
+    result = subprocess.run(command, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError("sim.py failed (%d): %s\n%s" % (
+            result.returncode, " ".join(command[3:]), result.stderr))
+    return (job, parseStats(result.stdout))
+
+def formatSummary(title, summary):
+    """
+    Render a summary in the same layout as the tables in DATA.
+    """
+    lines = [title]
+    for section in SECTIONS:
+        lines.append("%s: avg (stddev)" % section)
+        rows = sorted(summary.get(section, dict()).items(), key=lambda x: (x[1][0], x[0]))
+        for (peerId, (avg, dev)) in rows:
+            lines.append("%s: %.1f  (%.1f)" % (peerId, avg, dev))
+    return "\n".join(lines)
+
+def configTitle(mix, mode):
+    return "%s %s BANDWIDTHS" % (mix.upper(), mode.upper())
+
+def agentModules(mix, sim):
+    """
+    Modules sim.py loads for a mix: one per agent class, named after it in
+    lower case, plus the simulator itself.
+    """
+    modules = [entry.split(",")[0].lower() for entry in mix.split()]
+    return modules + [os.path.splitext(os.path.basename(sim))[0]]
+
+def cacheConfig(options, mix, mode, seed, codeHash):
+    """
+    Everything that determines the result of one iteration.
+    """
+    config = dict((name, getattr(options, name)) for name in SIM_OPTIONS)
+    config.update({"mix": mix.split(), "mode": mode, "seed": seed, "code": codeHash})
+    return config
+
+def runGrid(options, mixes, modes, sink, cache=None, stop=None):
+    """
+    Run options.iters iterations of every (mix, mode) pair on options.jobs
+    worker processes, handing each iteration to sink as soon as it is done.
+    Iterations found in cache are not run again. With stop, iterations run
+    in batches of options.batch and a configuration gets no more batches
+    once stop(title) is true, options.iters being the most it gets.
+
+    returns: {config title: iterations used}
+    """
+    simDir = os.path.dirname(os.path.abspath(options.sim))
+    codeHashes = dict()
+    for mix in mixes:
+        codeHashes[mix] = None
+        if cache is not None:
+            codeHashes[mix] = sourceHash(agentModules(mix, options.sim), simDir)
+    configs = [(mix, mode) for mix in mixes for mode in modes]
+    used = dict((configTitle(mix, mode), 0) for (mix, mode) in configs)
+    batch = options.iters if stop is None else max(1, options.batch)
+
+    pool = None
+    try:
+        while configs:
+            keys = dict()
+            jobs = []
+            for (mix, mode) in configs:
+                title = configTitle(mix, mode)
+                first = used[title]
+                used[title] = min(first + batch, options.iters)
+                for iteration in range(first, used[title]):
+                    seed = iterationSeed(options.seed, iteration)
+                    if cache is not None:
+                        key = cache.key(cacheConfig(options, mix, mode, seed, codeHashes[mix]))
+                        stats = cache.get(key)
+                        if stats is not None:
+                            # iterations are named by their seed, so one
+                            # appended again by a rerun is only counted once
+                            sink.addIteration(title, seed, stats)
+                            continue
+                        keys[(mix, mode, iteration)] = key
+                    jobs.append((mix, mode, iteration, simCommand(options, mix, mode, seed)))
+
+            if jobs:
+                if pool is None:
+                    pool = ProcessPoolExecutor(max_workers=options.jobs)
+                futures = [pool.submit(runIteration, job) for job in jobs]
+                for future in as_completed(futures):
+                    ((mix, mode, iteration, command), stats) = future.result()
+                    sink.addIteration(configTitle(mix, mode), iterationSeed(options.seed, iteration), stats)
+                    if cache is not None:
+                        cache.put(keys[(mix, mode, iteration)], stats)
+
+            configs = [(mix, mode) for (mix, mode) in configs
+                       if used[configTitle(mix, mode)] < options.iters
+                       and not (stop is not None and stop(configTitle(mix, mode)))]
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return used
+
+def stopRule(options, sink):
+    """
+    The early stopping test for runGrid, or None when every configuration
+    should get its options.iters iterations. A configuration is done, once
+    it has options.minIters iterations, when the 95% confidence intervals
+    of the per-iteration means of every agent type are narrower than
+    --ciWidth completion rounds and --ciUpload upload blocks (those given),
+    or, with --separate, when the completion round intervals of the
+    non-seed agent types no longer overlap.
+    """
+    widths = [(section, width) for (section, width) in (("Completion rounds", options.ciWidth),
+                                                          ("Upload bandwidth", options.ciUpload))
+              if width is not None]
+    if not widths and not options.separate:
+        return None
+
+    def stop(config):
+        if sink.iterations.get(config, 0) < options.minIters:
+            return False
+        if widths:
+            found = [(width, sink.intervals(config, section)) for (section, width) in widths]
+            # a section with no intervals at all has not converged
+            if all(intervals and all(2 * half <= width for (mean, half) in intervals.values())
+                   for (width, intervals) in found):
+                return True
+        if options.separate:
+            spans = sorted((mean - half, mean + half)
+                           for (name, (mean, half)) in sink.intervals(config, "Completion rounds").items()
+                           if "Seed" not in name)
+            if len(spans) >= 2 and all(a[1] < b[0] for (a, b) in zip(spans, spans[1:])):
+                return True
+        return False
+    return stop
+
+def main(args):
+    usage_msg = "Usage:  %prog [options] \"PeerClass1,count PeerClass2,count ...\" ..."
+    parser = OptionParser(usage=usage_msg)
+    parser.add_option("--sim", dest="sim", default="sim.py",
+                      help="path to the simulator")
+    parser.add_option("--numPieces", dest="numPieces", default=128, type="int")
+    parser.add_option("--blocksPerPiece", dest="blocksPerPiece", default=16, type="int")
+    parser.add_option("--minBw", dest="minBw", default=16, type="int")
+    parser.add_option("--maxBw", dest="maxBw", default=32, type="int")
+    parser.add_option("--maxRound", dest="maxRound", default=1000, type="int")
+    parser.add_option("--iters", dest="iters", default=32, type="int",
+                      help="iterations per configuration; the most used when stopping early")
+    parser.add_option("--ciWidth", dest="ciWidth", default=None, type="float",
+                      help="stop a configuration once every agent type's 95%% CI on "
+                           "completion rounds is narrower than this")
+    parser.add_option("--ciUpload", dest="ciUpload", default=None, type="float",
+                      help="likewise for upload bandwidth")
+    parser.add_option("--separate", dest="separate", default=False, action="store_true",
+                      help="stop a configuration once the agent types' completion round "
+                           "CIs stop overlapping")
+    parser.add_option("--minIters", dest="minIters", default=4, type="int",
+                      help="iterations before stopping early is considered")
+    parser.add_option("--batch", dest="batch", default=os.cpu_count(), type="int",
+                      help="iterations per configuration between stopping checks "
+                           "(default: one per core)")
+    parser.add_option("--seed", dest="seed", default=0, type="int",
+                      help="base seed the per-iteration seeds are derived from")
+    parser.add_option("--bwModes", dest="bwModes", default="uniform",
+                      help="comma separated bandwidth modes: %s" % ",".join(sorted(BW_MODES)))
+    parser.add_option("--jobs", dest="jobs", default=os.cpu_count(), type="int",
+                      help="worker processes (default: one per core)")
+    parser.add_option("--out", dest="out", default=None,
+                      help="also append the tables to this file")
+    parser.add_option("--metrics", dest="metrics", default=None,
+                      help="append every finished iteration to this JSON lines file")
+    parser.add_option("--cacheDir", dest="cacheDir", default=".simcache",
+                      help="directory of cached per-iteration results")
+    parser.add_option("--cacheMaxMB", dest="cacheMaxMB", default=None, type="float",
+                      help="evict least recently used results past this size")
+    parser.add_option("--noCache", dest="noCache", default=False, action="store_true",
+                      help="run every iteration even if it is cached")
+    (options, mixes) = parser.parse_args(args)
+
+    modes = options.bwModes.split(",")
+    for mode in modes:
+        if mode not in BW_MODES:
+            parser.error("unknown bandwidth mode %s" % mode)
+    if len(mixes) == 0:
+        parser.error("need at least one agent mix")
+
+    cache = None
+    if not options.noCache:
+        maxBytes = None
+        if options.cacheMaxMB is not None:
+            maxBytes = int(options.cacheMaxMB * 1024 * 1024)
+        cache = ResultCache(options.cacheDir, maxBytes)
+
+    sink = MetricsSink(options.metrics)
+    stop = stopRule(options, sink)
+    try:
+        used = runGrid(options, mixes, modes, sink, cache, stop)
+    finally:
+        sink.close()
+    tables = [formatSummary(configTitle(mix, mode), sink.summary(configTitle(mix, mode)))
+              for mix in mixes for mode in modes]
+    text = "\n~~~\n\n".join(tables) + "\n"
+    print(text)
+    if options.out is not None:
+        with open(options.out, "a") as f:
+            f.write(text)
+    if stop is not None:
+        for (title, iterations) in used.items():
+            sys.stderr.write("%s: %d of %d iterations\n" % (title, iterations, options.iters))
+        sys.stderr.write("iterations: %d of %d\n" % (sum(used.values()), options.iters * len(used)))
+    if cache is not None:
+        stats = cache.stats()
+        sys.stderr.write("cache: %d hits, %d misses, %d evicted, %d entries (%.1f MB)\n" % (
+            stats["hits"], stats["misses"], stats["evictions"], stats["entries"],
+            stats["bytes"] / (1024.0 * 1024.0)))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,105 @@
+# One frozen view of every peer per round, built once and shared by all the
+# agents instead of each agent getting (and re-deriving) its own copy.
+
+import collections
+
+from bitfield import toBits
+
+# what an agent sees of one peer: PeerInfo's fields plus the bitfield of its
+# pieces (see bitfield.py); availablePieces is a tuple so nobody can change it
+PeerView = collections.namedtuple("PeerView", "id availablePieces bits")
+
+def bitsOf(peer):
+    """
+    Bitfield of a peer's pieces, precomputed if it came from a snapshot.
+    """
+    bits = getattr(peer, "bits", None)
+    if bits is None:
+        bits = toBits(peer.availablePieces)
+    return bits
+
+class PeerSnapshot:
+    """
+    Every peer's id and complete pieces at the start of a round, with a
+    lookup by id. It is read-only: agents get views of it from without().
+    """
+    __slots__ = ("views", "index")
+
+    def __init__(self, peers, previous=None):
+        """
+        peers: PeerInfo-like objects (id, availablePieces)
+        previous: last round's snapshot; views of peers that gained no
+        pieces since are reused rather than rebuilt
+        """
+        views = []
+        for p in peers:
+            old = previous.get(p.id) if previous is not None else None
+            if old is not None and len(old.availablePieces) == len(p.availablePieces):
+                views.append(old)
+            else:
+                pieces = tuple(p.availablePieces)
+                views.append(PeerView(p.id, pieces, toBits(pieces)))
+        self.views = tuple(views)
+        self.index = dict((v.id, i) for (i, v) in enumerate(self.views))
+
+    def get(self, peerId):
+        i = self.index.get(peerId)
+        return None if i is None else self.views[i]
+
+    def without(self, peerId):
+        """
+        returns: the snapshot as peerId sees it, everyone but itself, without
+        copying
+        """
+        return SnapshotView(self, self.index.get(peerId))
+
+    def among(self, peerIds):
+        """
+        returns: the views of just these peers, e.g. one peer's neighbors,
+        as a tuple in snapshot order. Being a plain tuple, rarity.sharedIndex
+        reads only these peers from it rather than the whole snapshot.
+        """
+        index = self.index
+        return tuple(self.views[i] for i in sorted(index[peerId] for peerId in peerIds))
+
+    def __len__(self):
+        return len(self.views)
+
+    def __iter__(self):
+        return iter(self.views)
+
+    def __getitem__(self, i):
+        return self.views[i]
+
+class SnapshotView:
+    """
+    A PeerSnapshot minus one peer, usable wherever the peers list handed to
+    requests() and uploads() is: len(), iteration and indexing, plus get().
+    """
+    __slots__ = ("snapshot", "skip")
+
+    def __init__(self, snapshot, skip):
+        self.snapshot = snapshot
+        self.skip = skip
+
+    def get(self, peerId):
+        i = self.snapshot.index.get(peerId)
+        return None if i is None or i == self.skip else self.snapshot.views[i]
+
+    def __len__(self):
+        return len(self.snapshot.views) - (self.skip is not None)
+
+    def __iter__(self):
+        views = self.snapshot.views
+        if self.skip is None:
+            return iter(views)
+        return (v for (i, v) in enumerate(views) if i != self.skip)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("snapshot index out of range")
+        if self.skip is not None and i >= self.skip:
+            i += 1
+        return self.snapshot.views[i]
@@ -0,0 +1,112 @@
+# A super-seeding seed (BitTorrent's BEP 16, adapted to the simulator's
+# request model). A plain Seed serves whoever asks, so early on it sends
+# the same pieces to several peers while other pieces are nowhere in the
+# swarm yet. SuperSeed places each piece with one peer at a time:
+#  - a peer is only served the piece at the head of its requests to us
+#    (an upload fills a peer's requests in order), and only that piece's
+#    missing blocks
+#  - a piece is handed to one peer and not to anyone else until at least
+#    `spreadCopies` non-seed peers hold it, i.e. that peer passed it on, or
+#    `spreadRounds` rounds went by (it may have gone to a freerider)
+#  - pieces nobody has been handed come first, then the least spread
+# Bandwidth that no such request can use is left idle rather than spent on
+# pieces the swarm can trade among itself.
+
+import random
+import logging
+
+from messages import Upload
+from peer import Peer
+from instrument import instrumented
+from rarity import RarityIndex
+from snapshot import bitsOf
+
+@instrumented
+class SuperSeed(Peer):
+    # eventsim.py: start with every piece, like Seed
+    startsFull = True
+    # eventsim.py: uploads() reads the pieces in `peers`, so a HAVE wakes it
+    uploadsReadPieces = True
+    # non-seed copies after which a piece counts as spread
+    spreadCopies = 2
+    # rounds after which a placed piece that did not spread can be handed out again
+    spreadRounds = 10
+
+    def postInit(self):
+        print("postInit(): %s here!" % self.id)
+        # copies of each piece among the non-seed peers
+        self.index = RarityIndex()
+        self.assigned = dict()  # peerId -> the piece it is being handed
+        self.placed = dict()    # pieceId -> round it was last handed out
+
+    def requests(self, peers, history):
+        """
+        A seed has every piece and asks for nothing.
+        """
+        return []
+
+    def uploads(self, requests, peers, history):
+        """
+        requests -- a list of the requests for this peer for this round
+        peers -- available info about all the peers
+        history -- history for all previous rounds
+
+        returns: list of Upload objects.
+
+        In each round, this will be called after requests().
+        """
+        round = history.currentRound()
+        logging.debug("%s again.  It's round %d.", self.id, round)
+        for p in peers:
+            if "Seed" not in p.id:
+                self.index.observe(p.id, p.availablePieces, bitsOf(p))
+        if len(requests) == 0:
+            return []
+
+        # what each requester would be served first
+        first = dict()
+        for r in requests:
+            if r.requesterId not in first:
+                first[r.requesterId] = r
+        inFlight = set()
+        for (peerId, pieceId) in list(self.assigned.items()):
+            r = first.get(peerId)
+            if r is None or r.pieceId != pieceId:
+                # finished with it, or moved on
+                del self.assigned[peerId]
+            else:
+                inFlight.add(pieceId)
+
+        def handOut(pieceId):
+            if pieceId in inFlight:
+                return False
+            last = self.placed.get(pieceId)
+            return (last is None or self.index.counts.get(pieceId, 0) >= self.spreadCopies
+                    or round - last >= self.spreadRounds)
+
+        continuing = [j for j in first if j in self.assigned]
+        fresh = [j for j in first if j not in self.assigned and handOut(first[j].pieceId)]
+        random.shuffle(continuing)
+        random.shuffle(fresh)
+        # never handed out first, then fewest copies
+        fresh.sort(key=lambda j: (first[j].pieceId in self.placed,
+                                  self.index.counts.get(first[j].pieceId, 0)))
+
+        uploads = []
+        left = self.upBw
+        for j in continuing + fresh:
+            if left == 0:
+                break
+            r = first[j]
+            if j not in self.assigned:
+                if r.pieceId in inFlight:
+                    # someone earlier in this round took it
+                    continue
+                self.assigned[j] = r.pieceId
+                self.placed[r.pieceId] = round
+                inFlight.add(r.pieceId)
+            bw = min(left, self.conf.blocksPerPiece - r.start)
+            uploads.append(Upload(self.id, j, bw))
+            left -= bw
+        logging.debug("Still here: uploading %s", [(u.toId, u.bw) for u in uploads])
+        return uploads
@@ -0,0 +1,72 @@
+# Checks the columnar history against plain per-round lists:
+#   python3 -m pytest test_columnar.py
+# Needs the simulator's messages.py on the path; skipped without it.
+
+import random
+
+import pytest
+
+pytest.importorskip("messages")
+
+from columnar import ColumnarHistory
+from deficit import DeficitLedger
+
+def randomHistory(rng, selfId, peerIds, rounds):
+    """
+    returns: (ColumnarHistory, [(downloads, uploads)] as tuples per round)
+    """
+    history = ColumnarHistory(list(peerIds))
+    expected = []
+    for r in range(rounds):
+        # rounds the peer sleeps through stay empty
+        if rng.random() < 0.2:
+            expected.append(([], []))
+            continue
+        history.padTo(r + 1)
+        downloads = []
+        for i in range(rng.randrange(4)):
+            d = (rng.choice(peerIds), selfId, rng.randrange(32), rng.randint(1, 16))
+            history.addDownload(*d)
+            downloads.append(d)
+        uploads = []
+        for i in range(rng.randrange(4)):
+            bw = rng.randint(1, 16)
+            u = (selfId, rng.choice(peerIds), bw, rng.randint(0, bw))
+            history.addUpload(*u)
+            uploads.append(u)
+        expected.append((downloads, uploads))
+    history.padTo(rounds)
+    return (history, expected)
+
+def test_rounds_match_the_events_added():
+    rng = random.Random(1)
+    peerIds = ["Peer%d" % i for i in range(6)]
+    (history, expected) = randomHistory(rng, "Me", peerIds, 50)
+    assert history.currentRound() == len(expected) == len(history.downloads)
+    for (r, (downloads, uploads)) in enumerate(expected):
+        assert [(d.fromId, d.toId, d.piece, d.blocks) for d in history.downloads[r]] == downloads
+        assert [(u.fromId, u.toId, u.bw, u.actual) for u in history.uploads[r]] == uploads
+    assert len(history.downloads[10:20]) == 10
+    assert ([(d.fromId, d.blocks) for d in history.downloads[-1]] ==
+            [(d[0], d[3]) for d in expected[-1][0]])
+
+def test_queries_match_a_rescan():
+    rng = random.Random(2)
+    peerIds = ["Peer%d" % i for i in range(6)]
+    (history, expected) = randomHistory(rng, "Me", peerIds, 60)
+    for (a, b) in ((0, 60), (5, 10), (59, 60), (20, 20)):
+        received = dict()
+        net = dict()
+        for (downloads, uploads) in expected[a:b]:
+            for (fromId, toId, piece, blocks) in downloads:
+                received[fromId] = received.get(fromId, 0) + blocks
+                net[fromId] = net.get(fromId, 0) + blocks
+            for (fromId, toId, bw, actual) in uploads:
+                net[toId] = net.get(toId, 0) - actual
+        assert history.receivedFrom(a, b) == received
+        assert history.netBalance(a, b) == dict((p, v) for (p, v) in net.items() if v != 0)
+    ledger = DeficitLedger()
+    ledger.update(history)
+    net = history.netBalance()
+    for peerId in peerIds:
+        assert ledger.get(peerId) == net.get(peerId, 0)
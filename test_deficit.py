@@ -0,0 +1,162 @@
+# Checks the deficit ledger and upload allocation against the loops they
+# replaced:
+#   python3 -m pytest test_deficit.py
+
+import random
+import threading
+import collections
+
+from deficit import DeficitLedger, allocate
+
+# just the fields the agents read from history and requests
+Download = collections.namedtuple("Download", "fromId toId piece blocks")
+Upload = collections.namedtuple("Upload", "fromId toId bw actual")
+Request = collections.namedtuple("Request", "requesterId peerId pieceId start")
+Peer = collections.namedtuple("Peer", "id")
+
+class History:
+    def __init__(self):
+        self.downloads = []
+        self.uploads = []
+
+def randomRound(rng, selfId, peerIds):
+    downloads = [Download(rng.choice(peerIds), selfId, rng.randrange(32), rng.randint(1, 16))
+                 for i in range(rng.randrange(5))]
+    uploads = []
+    for i in range(rng.randrange(5)):
+        bw = rng.randint(1, 16)
+        uploads.append(Upload(selfId, rng.choice(peerIds), bw, rng.randint(0, bw)))
+    return (downloads, uploads)
+
+def rescanBalance(peerId, history):
+    """
+    FairTorrent.sortPeerList()'s DF value before the ledger: a rescan of
+    the whole history.
+    """
+    counter = 0
+    for aRound in history.downloads:
+        for event in aRound:
+            if event.fromId == peerId:
+                counter += event.blocks
+    for aRound in history.uploads:
+        for event in aRound:
+            if event.toId == peerId:
+                counter = counter - event.actual
+    return counter
+
+def peerOrder(peers, df, seed):
+    """
+    sortPeerList() and the sort in uploads(): DF value, largest first, with
+    ties broken by a shuffle.
+    """
+    scores = [[p.id, df(p.id)] for p in peers]
+    random.Random(seed).shuffle(scores)
+    for x in range(len(scores)):
+        scores[x].append(x)
+    scores.sort(key=lambda x: (x[1], x[2]), reverse=True)
+    return [x[0] for x in scores]
+
+def rescanAllocate(peerScores, requests, limit, blocksPerPiece):
+    """
+    FairTorrent.uploads()'s loop before allocate(); it only ends if some
+    requester can take a block.
+    """
+    requestIDs = set(r.requesterId for r in requests)
+    frequencyLists = sorted(peerScores, key=lambda x: (x[1], x[2]), reverse=True)
+    bws = []
+    uploadList = []
+    while limit > 0:
+        for x in frequencyLists:
+            if x[0] in requestIDs:
+                for request in requests:
+                    if request.requesterId == x[0]:
+                        current = request
+                bitsToUse = blocksPerPiece - current.start
+                b = min(bitsToUse, limit)
+                limit -= b
+                if b != 0:
+                    uploadList.append(x[0])
+                    bws.append(b)
+    return (uploadList, bws)
+
+def fairPriority(x):
+    return (-x[1], -x[2])
+
+def test_ledger_matches_rescan():
+    rng = random.Random(1)
+    peers = [Peer("Peer%d" % i) for i in range(8)]
+    peerIds = [p.id for p in peers]
+    for run in range(20):
+        history = History()
+        ledger = DeficitLedger()
+        for r in range(60):
+            (downloads, uploads) = randomRound(rng, "Me", peerIds)
+            history.downloads.append(downloads)
+            history.uploads.append(uploads)
+            # the agent is not asked every round
+            if rng.random() < 0.3:
+                continue
+            ledger.update(history)
+            for peerId in peerIds:
+                assert ledger.get(peerId) == rescanBalance(peerId, history)
+            seed = rng.random()
+            assert (peerOrder(peers, ledger.get, seed) ==
+                    peerOrder(peers, lambda p: rescanBalance(p, history), seed))
+
+def test_ledger_starts_over_on_new_run():
+    rng = random.Random(2)
+    peerIds = ["Peer%d" % i for i in range(4)]
+    history = History()
+    ledger = DeficitLedger()
+    for r in range(10):
+        (downloads, uploads) = randomRound(rng, "Me", peerIds)
+        history.downloads.append(downloads)
+        history.uploads.append(uploads)
+        ledger.update(history)
+    history = History()
+    (downloads, uploads) = randomRound(rng, "Me", peerIds)
+    history.downloads.append(downloads)
+    history.uploads.append(uploads)
+    ledger.update(history)
+    for peerId in peerIds:
+        assert ledger.get(peerId) == rescanBalance(peerId, history)
+
+def test_allocate_matches_old_loop():
+    rng = random.Random(3)
+    blocksPerPiece = 16
+    for case in range(2000):
+        peerIds = ["Peer%d" % i for i in range(rng.randint(1, 8))]
+        scores = [[peerId, rng.randint(-20, 20), x] for (x, peerId) in enumerate(peerIds)]
+        requesters = rng.sample(peerIds, rng.randint(1, len(peerIds)))
+        # every requester can take a block, or the old loop never ends
+        requests = [Request(j, "Me", rng.randrange(32), rng.randrange(blocksPerPiece))
+                    for j in requesters for i in range(rng.randint(1, 3))]
+        limit = rng.randint(1, 40)
+        assert (allocate(scores, requests, limit, blocksPerPiece, fairPriority) ==
+                rescanAllocate(scores, requests, limit, blocksPerPiece))
+
+def returns(fn, seconds=5):
+    """
+    returns: (True, fn()) if fn returned within seconds, else (False, None)
+    """
+    result = []
+    worker = threading.Thread(target=lambda: result.append(fn()), daemon=True)
+    worker.start()
+    worker.join(seconds)
+    return (not worker.is_alive(), result[0] if result else None)
+
+def test_allocate_returns_when_nobody_can_take_a_block():
+    scores = [["Peer0", 3, 0], ["Peer1", 1, 1]]
+    # both last asked for a block past the end of the piece
+    requests = [Request("Peer0", "Me", 5, 16), Request("Peer1", "Me", 7, 16)]
+    (finished, result) = returns(lambda: allocate(scores, requests, 24, 16, fairPriority))
+    assert finished
+    assert result == ([], [])
+
+def test_allocate_skips_a_requester_that_cannot_take_a_block():
+    scores = [["Peer0", 3, 0], ["Peer1", 1, 1]]
+    requests = [Request("Peer0", "Me", 5, 16), Request("Peer1", "Me", 7, 10)]
+    (finished, result) = returns(lambda: allocate(scores, requests, 24, 16, fairPriority))
+    assert finished
+    # Peer1 takes the 6 blocks it has left, round after round
+    assert result == (["Peer1"] * 4, [6, 6, 6, 6])
@@ -0,0 +1,33 @@
+# Checks the exchange counts against the histories they summarise:
+#   python3 -m pytest test_exchanges.py
+# The eventsim.py test needs the simulator's modules on the path and is
+# skipped without them.
+
+import pytest
+
+from exchanges import ExchangeCounter
+
+def test_repeated_uploads_are_one_unchoke():
+    counter = ExchangeCounter()
+    counter.recordRound([("A", "B", 4), ("A", "B", 2), ("B", "A", 0)])
+    counter.recordRound([("A", "B", 3)])
+    assert counter.unchokes == {("A", "B"): 2, ("B", "A"): 1}
+    assert counter.blocks == {("A", "B"): 9}
+
+def test_eventsim_counts_match_histories():
+    pytest.importorskip("messages")
+    eventsim = pytest.importorskip("eventsim")
+    sim = eventsim.EventSim([("Seed", 2), ("BitTorrent", 6), ("FairTorrent", 6), ("Freerider", 1)],
+                            32, 4, 8, 16, 200, seed=4)
+    sim.run()
+    unchokes = dict()
+    blocks = dict()
+    for (peerId, history) in sim.history.items():
+        for aRound in history.uploads:
+            for (a, b) in set((u.fromId, u.toId) for u in aRound):
+                unchokes[(a, b)] = unchokes.get((a, b), 0) + 1
+        for aRound in history.downloads:
+            for d in aRound:
+                blocks[(d.fromId, d.toId)] = blocks.get((d.fromId, d.toId), 0) + d.blocks
+    assert sim.exchanges.unchokes == unchokes
+    assert sim.exchanges.blocks == blocks
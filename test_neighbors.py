@@ -0,0 +1,51 @@
+# Checks that neighbor sets stay bounded and symmetric, and that runs with
+# --neighbors are reproducible:
+#   python3 -m pytest test_neighbors.py
+# The eventsim.py tests need the simulator's modules (messages.py, peer.py,
+# seed.py) on the path and are skipped without them.
+
+import pytest
+
+from neighbors import NeighborTracker
+
+def neighborSets(tracker):
+    return dict((peerId, sorted(tracker.of(peerId))) for peerId in tracker.ids)
+
+def checkSets(tracker):
+    for a in tracker.ids:
+        assert a not in tracker.of(a)
+        assert len(tracker.of(a)) <= tracker.size
+        for b in tracker.of(a):
+            assert a in tracker.of(b)
+
+def test_tracker_same_seed_same_neighbors():
+    peerIds = ["Peer%d" % i for i in range(60)]
+    first = NeighborTracker(peerIds, 5, refreshEvery=3, seed=7)
+    second = NeighborTracker(peerIds, 5, refreshEvery=3, seed=7)
+    for round in range(30):
+        assert first.refresh(round) == second.refresh(round)
+        assert neighborSets(first) == neighborSets(second)
+        checkSets(first)
+
+def test_tracker_refreshes_without_a_seed():
+    tracker = NeighborTracker(["Peer%d" % i for i in range(30)], 4, refreshEvery=2)
+    for round in range(10):
+        tracker.refresh(round)
+        checkSets(tracker)
+
+MIX = [("Seed", 2), ("BitTorrent", 10), ("FairTorrent", 10)]
+
+def runSwarm(seed):
+    eventsim = pytest.importorskip("eventsim")
+    sim = eventsim.EventSim(MIX, 32, 4, 16, 32, 200, seed=seed, neighbors=4, refresh=3)
+    sim.run()
+    return (sim.completion, sim.uploaded, neighborSets(sim.tracker))
+
+def test_eventsim_neighbors_same_seed_same_run():
+    pytest.importorskip("messages")
+    assert runSwarm(11) == runSwarm(11)
+
+def test_eventsim_neighbors_without_a_seed():
+    pytest.importorskip("messages")
+    (completion, uploaded, neighbors) = runSwarm(None)
+    assert len(completion) == sum(count for (name, count) in MIX)
@@ -0,0 +1,459 @@
+# Runs the agent classes as asyncio peers that talk a BitTorrent-style peer
+# wire protocol (bitfield/have/interested/request/cancel/piece/choke/
+# unchoke) to each other over localhost TCP, to see real bytes/sec and
+# request latency under socket I/O. Nothing leaves the loopback interface.
+#
+# Every `tick` seconds each peer runs one round of its agent:
+#  - requests() turns into INTERESTED for the peers it asks for anything
+#    and NOT_INTERESTED for the rest. Only once a peer has unchoked us do
+#    we send it REQUESTs for the blocks of each piece from the requested
+#    start block on, and CANCELs for blocks no longer asked for. A CHOKE
+#    drops our requests to that peer, as the protocol says the choking
+#    side discards them. Blocks are served in order, as in sim.py.
+#  - uploads() sees the requests of the peers we have unchoked, and for an
+#    interested peer we still choke, a request for the first piece we have
+#    and it lacks (it cannot send REQUESTs yet). It turns into UNCHOKE for
+#    the peers it uploads to and CHOKE for the rest, which drops their
+#    requests. An unchoked peer is sent up to its Upload's bw blocks that
+#    round, paced by a token bucket of upBw blocks per tick.
+# Messages arrive asynchronously, so uploads() sees the requests received
+# so far rather than this round's, as a real client would.
+#
+# Run from the simulator directory (the agents need messages.py, util.py
+# and peer.py):
+#   python3 wire.py --numPieces=32 --blocksPerPiece=8 --minBw=8 --maxBw=16
+#       --blockSize=1024 --tick=0.1 Seed,2 BitTorrent,5 FairTorrent,5 Freerider,1
+
+import sys
+import time
+import struct
+import random
+import asyncio
+from optparse import OptionParser
+
+from messages import Upload, Request, Download, PeerInfo
+from runner import formatSummary
+from metrics import agentType, Welford
+from eventsim import Config, PeerHistory, makeAgents
+
+# message ids, as in the BitTorrent peer wire protocol
+CHOKE, UNCHOKE, INTERESTED, NOT_INTERESTED, HAVE, BITFIELD, REQUEST, PIECE, CANCEL = range(9)
+
+def encodeBitfield(pieces, blocksPerPiece):
+    """
+    The BITFIELD payload: bit i set if piece i is complete, piece 0 in the
+    high bit of the first byte.
+    """
+    data = bytearray((len(pieces) + 7) // 8)
+    for (i, blocks) in enumerate(pieces):
+        if blocks == blocksPerPiece:
+            data[i >> 3] |= 0x80 >> (i & 7)
+    return bytes(data)
+
+def decodeBitfield(data, numPieces):
+    return set(i for i in range(numPieces) if data[i >> 3] & (0x80 >> (i & 7)))
+
+class TokenBucket:
+    """
+    Allows `rate` bytes per second on average with bursts of up to
+    `capacity` bytes.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+
+    async def take(self, n):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= n:
+                self.tokens -= n
+                return
+            await asyncio.sleep((n - self.tokens) / self.rate)
+
+class Connection:
+    """
+    One side of a connection to a remote peer.
+    """
+    def __init__(self, reader, writer, remoteId):
+        self.reader = reader
+        self.writer = writer
+        self.remoteId = remoteId
+        self.have = set()
+        # choke and interest state, both ways, as the protocol starts it
+        self.amChoking = True
+        self.amInterested = False
+        self.peerChoking = True
+        self.peerInterested = False
+        # blocks we want from the remote, requested once it unchokes us
+        self.wanted = []
+        # blocks we asked the remote for: {(piece, block): time sent}
+        self.outstanding = dict()
+        # blocks the remote asked us for, in arrival order
+        self.pending = []
+        # blocks we may still send it this round
+        self.quota = 0
+
+    def send(self, messageId, payload=b""):
+        self.writer.write(struct.pack(">IB", len(payload) + 1, messageId) + payload)
+
+    async def receive(self):
+        (length,) = struct.unpack(">I", await self.reader.readexactly(4))
+        data = await self.reader.readexactly(length)
+        return (data[0], data[1:])
+
+async def handshake(reader, writer, peerId):
+    """
+    Swap peer ids: a length byte and the id, each way.
+
+    returns: the remote peer id
+    """
+    name = peerId.encode()
+    writer.write(bytes([len(name)]) + name)
+    (length,) = await reader.readexactly(1)
+    return (await reader.readexactly(length)).decode()
+
+class WirePeer:
+    """
+    An agent behind a listening socket and one connection per other peer.
+    """
+    def __init__(self, agent, blockSize, tick):
+        self.agent = agent
+        self.conf = agent.conf
+        self.blockSize = blockSize
+        self.tick = tick
+        rate = agent.upBw * blockSize / tick
+        self.bucket = TokenBucket(rate, agent.upBw * blockSize)
+        self.connections = dict()
+        self.history = PeerHistory()
+        self.downloads = []
+        # this round's uploads by receiver; serveLoop() counts the blocks
+        # actually sent into their `actual`
+        self.uploads = dict()
+        self.wake = asyncio.Event()
+        self.server = None
+        self.port = None
+        self.tasks = []
+
+        self.completion = 0 if self.missing() == 0 else None
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.blocksUploaded = 0
+        self.wasted = 0
+        self.latencies = []
+
+    def missing(self):
+        return sum(1 for b in self.agent.pieces if b < self.conf.blocksPerPiece)
+
+    async def listen(self):
+        self.server = await asyncio.start_server(self.accept, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def accept(self, reader, writer):
+        remoteId = await handshake(reader, writer, self.agent.id)
+        self.attach(Connection(reader, writer, remoteId))
+
+    async def connect(self, port):
+        (reader, writer) = await asyncio.open_connection("127.0.0.1", port)
+        remoteId = await handshake(reader, writer, self.agent.id)
+        self.attach(Connection(reader, writer, remoteId))
+
+    def attach(self, conn):
+        self.connections[conn.remoteId] = conn
+        conn.send(BITFIELD, encodeBitfield(self.agent.pieces, self.conf.blocksPerPiece))
+        self.tasks.append(asyncio.ensure_future(self.readLoop(conn)))
+
+    async def readLoop(self, conn):
+        try:
+            while True:
+                (messageId, payload) = await conn.receive()
+                self.handle(conn, messageId, payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    def handle(self, conn, messageId, payload):
+        if messageId == BITFIELD:
+            conn.have = decodeBitfield(payload, self.conf.numPieces)
+        elif messageId == HAVE:
+            conn.have.add(struct.unpack(">I", payload)[0])
+        elif messageId == CHOKE:
+            conn.peerChoking = True
+            # the remote discards our requests when it chokes us
+            conn.outstanding.clear()
+        elif messageId == UNCHOKE:
+            conn.peerChoking = False
+            self.flushRequests(conn)
+        elif messageId == INTERESTED:
+            conn.peerInterested = True
+        elif messageId == NOT_INTERESTED:
+            conn.peerInterested = False
+            conn.pending = []
+        elif messageId == REQUEST:
+            # requests from a peer we choke are ignored
+            if not conn.amChoking:
+                (piece, begin, length) = struct.unpack(">III", payload)
+                conn.pending.append((piece, begin // self.blockSize))
+                self.wake.set()
+        elif messageId == CANCEL:
+            (piece, begin, length) = struct.unpack(">III", payload)
+            block = (piece, begin // self.blockSize)
+            if block in conn.pending:
+                conn.pending.remove(block)
+        elif messageId == PIECE:
+            self.received(conn, payload)
+
+    def received(self, conn, payload):
+        (piece, begin) = struct.unpack(">II", payload[:8])
+        block = begin // self.blockSize
+        self.bytesReceived += len(payload) - 8
+        sent = conn.outstanding.pop((piece, block), None)
+        if sent is not None:
+            self.latencies.append(time.monotonic() - sent)
+        pieces = self.agent.pieces
+        if pieces[piece] != block:
+            # a block we already have, or one out of order
+            self.wasted += 1
+            return
+        pieces[piece] += 1
+        self.downloads.append(Download(conn.remoteId, self.agent.id, piece, 1))
+        # as in endgame mode, take back the same request sent to others
+        for other in self.connections.values():
+            if other.outstanding.pop((piece, block), None) is not None:
+                other.send(CANCEL, struct.pack(">III", piece, begin, self.blockSize))
+        if pieces[piece] == self.conf.blocksPerPiece:
+            for other in self.connections.values():
+                other.send(HAVE, struct.pack(">I", piece))
+
+    def peerInfos(self):
+        return [PeerInfo(conn.remoteId, sorted(conn.have)) for conn in self.connections.values()]
+
+    def round(self, round):
+        """
+        Run the agent for one round and turn its decisions into messages.
+        """
+        self.history.downloads.append(self.downloads)
+        self.history.uploads.append(list(self.uploads.values()))
+        self.downloads = []
+        self.uploads = dict()
+        if self.completion is None and self.missing() == 0:
+            self.completion = round - 1
+
+        peers = self.peerInfos()
+        self.sendRequests(self.agent.requests(peers, self.history))
+
+        incoming = []
+        mine = set(i for (i, b) in enumerate(self.agent.pieces) if b == self.conf.blocksPerPiece)
+        for conn in self.connections.values():
+            if not conn.peerInterested:
+                continue
+            starts = dict()
+            for (piece, block) in conn.pending:
+                starts[piece] = min(block, starts.get(piece, block))
+            if not starts:
+                # choked, or its requests are not here yet: all we know is
+                # that it wants a piece we have
+                lacking = mine - conn.have
+                if lacking:
+                    starts[min(lacking)] = 0
+            incoming += [Request(conn.remoteId, self.agent.id, piece, start)
+                         for (piece, start) in starts.items()]
+        uploads = self.agent.uploads(incoming, peers, self.history)
+        for u in uploads:
+            sent = Upload(u.fromId, u.toId, u.bw)
+            sent.actual = 0
+            self.uploads[u.toId] = sent
+        quotas = dict((u.toId, u.bw) for u in uploads)
+        for conn in self.connections.values():
+            conn.quota = quotas.get(conn.remoteId, 0)
+            if conn.amChoking and conn.quota > 0:
+                conn.send(UNCHOKE)
+                conn.amChoking = False
+            elif not conn.amChoking and conn.quota == 0:
+                conn.send(CHOKE)
+                conn.amChoking = True
+                conn.pending = []
+        self.wake.set()
+
+    def sendRequests(self, requests):
+        wanted = dict((conn.remoteId, []) for conn in self.connections.values())
+        for r in requests:
+            wanted[r.peerId] += [(r.pieceId, block)
+                                 for block in range(r.start, self.conf.blocksPerPiece)]
+        for conn in self.connections.values():
+            conn.wanted = wanted[conn.remoteId]
+            if conn.wanted and not conn.amInterested:
+                conn.send(INTERESTED)
+                conn.amInterested = True
+            elif not conn.wanted and conn.amInterested:
+                conn.send(NOT_INTERESTED)
+                conn.amInterested = False
+            if not conn.peerChoking:
+                self.flushRequests(conn)
+
+    def flushRequests(self, conn):
+        """
+        Bring our requests to an unchoking peer in line with conn.wanted:
+        CANCEL the blocks no longer wanted and REQUEST the new ones.
+        """
+        now = time.monotonic()
+        pieces = self.agent.pieces
+        # blocks that arrived since the round started are no longer wanted
+        conn.wanted = [(piece, block) for (piece, block) in conn.wanted if block >= pieces[piece]]
+        keep = set(conn.wanted)
+        for (piece, block) in list(conn.outstanding):
+            if (piece, block) not in keep:
+                del conn.outstanding[(piece, block)]
+                conn.send(CANCEL, struct.pack(">III", piece, block * self.blockSize, self.blockSize))
+        for (piece, block) in conn.wanted:
+            if (piece, block) not in conn.outstanding:
+                conn.outstanding[(piece, block)] = now
+                conn.send(REQUEST, struct.pack(">III", piece, block * self.blockSize, self.blockSize))
+
+    async def serveLoop(self):
+        """
+        Send requested blocks to unchoked peers, one block per peer in turn,
+        as fast as the token bucket allows.
+        """
+        payload = bytes(self.blockSize)
+        while True:
+            ready = [conn for conn in self.connections.values()
+                     if conn.quota > 0 and conn.pending and not conn.amChoking]
+            if not ready:
+                self.wake.clear()
+                await self.wake.wait()
+                continue
+            for conn in ready:
+                await self.bucket.take(self.blockSize)
+                if conn.quota <= 0 or not conn.pending or conn.amChoking:
+                    continue
+                (piece, block) = conn.pending.pop(0)
+                conn.quota -= 1
+                conn.send(PIECE, struct.pack(">II", piece, block * self.blockSize) + payload)
+                await conn.writer.drain()
+                self.bytesSent += self.blockSize
+                self.blocksUploaded += 1
+                sent = self.uploads.get(conn.remoteId)
+                if sent is not None:
+                    sent.actual += 1
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        for conn in self.connections.values():
+            conn.writer.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+async def runSwarm(agents, blockSize, tick, maxRound):
+    """
+    Connect every pair of peers over loopback and run rounds every `tick`
+    seconds until everyone is done or maxRound.
+
+    returns: (list of WirePeer, rounds run, seconds)
+    """
+    peers = [WirePeer(agent, blockSize, tick) for agent in agents]
+    for p in peers:
+        await p.listen()
+    for (i, p) in enumerate(peers):
+        for q in peers[i + 1:]:
+            await p.connect(q.port)
+    # let every handshake and bitfield land
+    while any(len(p.connections) < len(peers) - 1 for p in peers):
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(tick)
+    for p in peers:
+        p.tasks.append(asyncio.ensure_future(p.serveLoop()))
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    round = 0
+    while round < maxRound and not all(p.completion is not None for p in peers):
+        for p in peers:
+            p.round(round)
+        round += 1
+        await asyncio.sleep(max(0.0, start + round * tick - loop.time()))
+    seconds = loop.time() - start
+    for p in peers:
+        if p.completion is None and p.missing() == 0:
+            p.completion = round - 1
+        await p.close()
+    return (peers, round, seconds)
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def report(peers, seconds):
+    """
+    returns: (summary for runner.formatSummary, text lines with bytes/sec,
+    request latency and wasted blocks per agent type)
+    """
+    summary = {"Upload bandwidth": dict(), "Completion rounds": dict()}
+    groups = dict()
+    for p in peers:
+        groups.setdefault(agentType(p.agent.id), []).append(p)
+    lines = ["Throughput (KB/s sent): avg (stddev)"]
+    for (name, members) in sorted(groups.items()):
+        up = Welford()
+        rounds = Welford()
+        rate = Welford()
+        for p in members:
+            up.add(p.blocksUploaded)
+            rate.add(p.bytesSent / seconds / 1024)
+            if p.completion is not None:
+                rounds.add(p.completion)
+        summary["Upload bandwidth"][name] = (up.mean, up.stddev())
+        if rounds.count:
+            summary["Completion rounds"][name] = (rounds.mean, rounds.stddev())
+        lines.append("%s: %.1f  (%.1f)" % (name, rate.mean, rate.stddev()))
+    lines.append("Request latency (ms): median, 95th percentile, wasted blocks")
+    for (name, members) in sorted(groups.items()):
+        latencies = [x for p in members for x in p.latencies]
+        wasted = sum(p.wasted for p in members)
+        if latencies:
+            lines.append("%s: %.1f, %.1f, %d" % (name, percentile(latencies, 0.5) * 1000,
+                                                 percentile(latencies, 0.95) * 1000, wasted))
+    return (summary, lines)
+
+def main(args):
+    usage_msg = "Usage:  %prog [options] PeerClass1,count PeerClass2,count ..."
+    parser = OptionParser(usage=usage_msg)
+    parser.add_option("--numPieces", dest="numPieces", default=32, type="int")
+    parser.add_option("--blocksPerPiece", dest="blocksPerPiece", default=8, type="int")
+    parser.add_option("--minBw", dest="minBw", default=8, type="int")
+    parser.add_option("--maxBw", dest="maxBw", default=16, type="int")
+    parser.add_option("--maxRound", dest="maxRound", default=200, type="int")
+    parser.add_option("--even", dest="even", default=False, action="store_true",
+                      help="bandwidths as set by upBwEven()")
+    parser.add_option("--seed", dest="seed", default=None, type="int")
+    parser.add_option("--blockSize", dest="blockSize", default=1024, type="int",
+                      help="bytes per block")
+    parser.add_option("--tick", dest="tick", default=0.1, type="float",
+                      help="seconds per round")
+    (options, mix) = parser.parse_args(args)
+
+    counts = []
+    for entry in mix:
+        (name, count) = entry.split(",")
+        counts.append((name, int(count)))
+    if len(counts) == 0:
+        parser.error("need at least one PeerClass,count")
+
+    random.seed(options.seed)
+    conf = Config(options.numPieces, options.blocksPerPiece, options.minBw, options.maxBw,
+                  options.maxRound)
+    agents = makeAgents(counts, conf, options.even)
+    (peers, rounds, seconds) = asyncio.run(runSwarm(agents, options.blockSize, options.tick,
+                                                    options.maxRound))
+    (summary, lines) = report(peers, seconds)
+    print(formatSummary("%s (%d rounds, %.1f s)" % (" ".join(mix), rounds, seconds), summary))
+    print("\n".join(lines))
+    unfinished = sum(1 for p in peers if p.completion is None)
+    if unfinished:
+        print("Unfinished peers: %d" % unfinished)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])